@@ -1,14 +1,167 @@
+import argparse
+import array
+import base64
+import bisect
+import collections
+import concurrent.futures
+import ctypes
+import errno
+import fcntl
+import fnmatch
+import glob
+import hashlib
+import json
+import mmap
 import os
+import platform
+import random
+import re
+import selectors
+import struct
 import sys
 import subprocess
 import signal
 import stat
+import threading
 import time
 
+try:
+    import tomllib
+except ImportError:  # Python < 3.11 reads JSON schema files only
+    tomllib = None
+
 # Global variables
 temp_files = []
 schema_sources = []
+status_board = None  # device -> [pass label, progress line] during parallel runs
+stop_event = threading.Event()
+libc = None  # Loaded on the first raw system call
+autotune_cache = None  # Loaded on the first autotuned pass
+autotune_lock = threading.Lock()
+journal = None  # Checkpoint state of the running schema, saved to journal_path
+journal_path = "disk_puri.journal"
+journal_lock = threading.Lock()
+journal_saving = True  # Cleared when journal_path cannot be written
+extent_maps = {}  # device -> {state: interval set}, saved next to the journal
+extent_lock = threading.RLock()
+rate_limits = {"global": 0, "jobs": 0}  # bytes/s, 0 = unlimited; devices override jobs
+rate_buckets = {}  # "global" or device -> token bucket
+rate_lock = threading.Lock()
+rate_control_path = "disk_puri.control"
+random_workers = None  # Keystream workers per device job, split between jobs
 DEFAULT_DD_FLAGS = "bs=4M iflag=fullblock oflag=direct conv=fdatasync status=progress"
+DEFAULT_ENGINE = "dd"
+IN_PROCESS_ENGINES = ("native", "async")
+DEFAULT_QUEUE_DEPTH = 8
+NATIVE_BLOCK_SIZE = 4 * 1024 * 1024
+DIRECT_IO_ALIGNMENT = 4096
+RANDOM_CHUNK_SIZE = 1024 * 1024
+KEYSTREAM = "shake128-ctr"
+VERIFY_SECTOR_SIZE = 512
+STATUS_INTERVAL = 5
+JOURNAL_INTERVAL = 10
+RETRY_BACKOFF = 1
+RETRY_BACKOFF_MAX = 60
+RATE_BURST = 0.25  # Seconds of traffic a bandwidth bucket can save up
+RATE_CONTROL_INTERVAL = 1
+EXTENT_STATES = ("written", "verified", "failed", "skipped")
+SCHEMA_PASS_KEYS = {
+    "device",
+    "type",
+    "engine",
+    "flags",
+    "seed",
+    "regions",
+    "queue_depth",
+    "pattern",
+    "path",
+    "continuous",
+    "autotune",
+    "tolerant",
+    "sample",
+    "expect",
+}
+SCHEMA_SETTINGS = {
+    "repeat": "repeat_count",
+    "max_retries": "max_retries",
+    "parallel_jobs": "parallel_jobs",
+}
+SCHEMA_RATE_LIMITS = {"rate_limit": "global", "job_rate_limit": "jobs"}
+FLEET_SELECTOR_KEYS = {
+    "glob",
+    "list",
+    "exclude",
+    "rotational",
+    "model",
+    "vendor",
+    "min_size",
+    "max_size",
+}
+BLKGETSIZE64 = 0x80081272
+BLKZEROOUT = 0x127F
+BLKDISCARD = 0x1277
+SYSFS_ROOT = "/sys"
+SAMPLE_BLOCK_SIZE = 4096
+TOPOLOGY_ATTRIBUTES = (
+    "logical_block_size",
+    "physical_block_size",
+    "optimal_io_size",
+    "max_sectors_kb",
+    "rotational",
+)
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+FALLOC_FL_ZERO_RANGE = 0x10
+OFFLOAD_CHUNK_SIZE = 1024 * 1024 * 1024
+STDERR_TAIL_LINES = 50
+# "<n> bytes (...) copied, <s> s, ..." (GNU), "<n> bytes transferred in <s> secs" (BSD)
+DD_PROGRESS = re.compile(r"^(\d+) bytes .*?(?:copied, | in )([\d.,]+) s")
+DD_SIZE_UNITS = {
+    "": 1,
+    "c": 1,
+    "w": 2,
+    "b": 512,
+    "kB": 1000,
+    "K": 1024,
+    "KiB": 1024,
+    "MB": 1000**2,
+    "M": 1024**2,
+    "MiB": 1024**2,
+    "GB": 1000**3,
+    "G": 1024**3,
+    "GiB": 1024**3,
+    "TB": 1000**4,
+    "T": 1024**4,
+    "TiB": 1024**4,
+}
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+PIPE_SIZE = 1024 * 1024
+
+# io_uring and Linux AIO constants (linux/io_uring.h, linux/aio_abi.h)
+IO_URING_SETUP, IO_URING_ENTER, IO_URING_REGISTER = 425, 426, 427
+IORING_OFF_SQ_RING, IORING_OFF_CQ_RING, IORING_OFF_SQES = 0, 0x8000000, 0x10000000
+IORING_FEAT_SINGLE_MMAP = 1
+IORING_ENTER_GETEVENTS = 1
+IORING_REGISTER_BUFFERS = 0
+IORING_OP_WRITE_FIXED = 5
+IO_URING_SQE = struct.Struct("<BBHiQQIIQHHiQQ")
+IO_URING_CQE = struct.Struct("<QiI")
+# io_setup, io_destroy, io_submit, io_getevents
+AIO_SYSCALLS = {"x86_64": (206, 207, 209, 208), "aarch64": (0, 1, 2, 4)}
+IOCB_CMD_PWRITE = 1
+AIO_IOCB = struct.Struct("<QIIHhIQQqQII")
+AIO_EVENT = struct.Struct("<QQqq")
+RANDOM_WORKERS = os.cpu_count() or 1
+RANDOM_RING_BYTES = 64 * 1024 * 1024  # Keystream blocks a generator may prefetch
+AUTOTUNE_CACHE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "disk_puri",
+    "autotune.json",
+)
+AUTOTUNE_TRIAL_BYTES = 32 * 1024 * 1024
+AUTOTUNE_BLOCK_SIZES = (256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+AUTOTUNE_QUEUE_DEPTHS = (1, 4, 16, 32)
+AUTOTUNE_MAX_IN_FLIGHT = 64 * 1024 * 1024  # Buffer memory a trial may allocate
 
 # Metadata dictionary defining sources
 source_types_metadata = {
@@ -18,135 +171,2441 @@ source_types_metadata = {
         "content": None,
         "continuous_write": False,
     },
+    "fast": {
+        "description": "fast random (seeded SHAKE-128 keystream, native engine)",
+        "if_device": KEYSTREAM,
+        "content": None,
+        "continuous_write": False,
+        "native_only": True,
+        "seeded": True,
+    },
+    "pattern": {
+        "description": "repeating hex pattern held in memory",
+        "shortcut": "t",
+        "requires_pattern": True,
+        "content": None,
+        "continuous_write": True,
+    },
     "zeros": {
         "description": "zeros",
         "if_device": "/dev/zero",
         "content": None,
         "continuous_write": False,
     },
+    "kernel": {
+        "description": "zeros written by the kernel (BLKZEROOUT / ZERO_RANGE)",
+        "if_device": "/dev/zero",
+        "content": None,
+        "continuous_write": False,
+        "offload": "zeroout",
+    },
+    "discard": {
+        "description": "discard/TRIM the device (BLKDISCARD / PUNCH_HOLE)",
+        "if_device": None,
+        "content": None,
+        "continuous_write": False,
+        "offload": "discard",
+    },
     "path": {
         "description": "content from system path",
         "requires_input_path": True,
         "content": None,
         "continuous_write": None,  # Will be set by user choice
     },
+    "verify": {
+        "description": "read back and compare (previous pass by default)",
+        "content": None,
+        "continuous_write": False,
+        "native_only": True,
+        "verify": True,
+    },
+}
+
+
+# Check if the given path is a block device
+def is_block_device(path):
+    return os.path.exists(path) and stat.S_ISBLK(os.stat(path).st_mode)
+
+
+# Check if the given path is a non-empty regular file usable as a target image
+def is_image_file(path):
+    return os.path.isfile(path) and os.path.getsize(path) > 0
+
+
+# Construct the dd command; continuous sources are fed to dd's stdin by
+# an in-process repeater. With a known size dd stops exactly at the end.
+def build_dd_command(if_device, of_device, flags, continuous_write, size=None):
+    if size and "count=" not in flags:
+        flags = f"{flags} {dd_count_operands(flags, size)}"
+    if os.path.isfile(of_device) and "notrunc" not in flags:
+        # dd truncates regular output files unless told otherwise
+        flags += " conv=notrunc"
+    if continuous_write:
+        return f"dd of={of_device} {flags}"
+    return f"dd if={if_device} of={of_device} {flags}"
+
+
+# Parse a dd size operand such as 4M, 512 or 1kB into bytes
+def parse_dd_size(value):
+    match = re.fullmatch(r"(\d+)([a-zA-Z]*)", value)
+    if not match or match.group(2) not in DD_SIZE_UNITS:
+        return None
+    return int(match.group(1)) * DD_SIZE_UNITS[match.group(2)]
+
+
+# dd operands limiting a pass to `size` bytes: whole blocks where possible,
+# otherwise a byte count (GNU dd)
+def dd_count_operands(flags, size):
+    operands = dict(flag.split("=", 1) for flag in flags.split() if "=" in flag)
+    block_size = parse_dd_size(operands.get("bs", operands.get("ibs", "512")))
+    if block_size and size % block_size == 0 and "fullblock" in flags:
+        return f"count={size // block_size}"
+    return f"count={size} iflag=count_bytes"
+
+
+# Describe a pass for display, including the repeater feeding dd
+def describe_pass(source_info):
+    if source_info.get("engine", "dd") == "dd" and source_info["continuous_write"]:
+        return f"repeat {source_info['source']} | {source_info['command']}"
+    return source_info["command"]
+
+
+# Describe a pass run by an in-process engine in dd-like terms
+def build_native_command(entry):
+    block_size = format_size(entry.get("block_size", NATIVE_BLOCK_SIZE))
+    command = (
+        f"{entry['engine']} if={entry['source']} of={entry['device']} bs={block_size}"
+    )
+    if entry.get("seed"):
+        command += f" seed={entry['seed']}"
+    if entry.get("regions", 1) > 1:
+        command += f" regions={entry['regions']}"
+    if entry.get("alignment", DIRECT_IO_ALIGNMENT) != DIRECT_IO_ALIGNMENT:
+        command += f" align={entry['alignment']}"
+    if entry.get("queue_depth"):
+        command += f" qd={entry['queue_depth']}"
+    if entry.get("autotune"):
+        command += " autotune"
+    if entry.get("tolerant"):
+        command += " tolerant"
+    return command + " repeat" if entry["continuous_write"] else command
+
+
+# Build a schema entry for the chosen engine
+def make_schema_entry(
+    device,
+    source_type,
+    if_device,
+    continuous_write,
+    engine,
+    flags,
+    seed=None,
+    regions=1,
+    queue_depth=None,
+    pattern=None,
+    autotune=False,
+    tolerant=False,
+):
+    entry = {
+        "device": device,
+        "type": source_type,
+        "flags": flags,
+        "command": None,
+        "engine": engine,
+        "source": if_device,
+        "continuous_write": bool(continuous_write),
+    }
+    if seed:
+        entry["seed"] = seed
+    if regions > 1:
+        entry["regions"] = regions
+    if queue_depth:
+        entry["queue_depth"] = queue_depth
+    if pattern:
+        entry["pattern"] = pattern
+    if autotune and engine in IN_PROCESS_ENGINES:
+        entry["autotune"] = True
+    if tolerant and engine in IN_PROCESS_ENGINES:
+        entry["tolerant"] = True
+    if engine in IN_PROCESS_ENGINES:
+        block_size, alignment = choose_geometry(probe_topology(device))
+        entry["block_size"] = block_size
+        entry["alignment"] = alignment
+        entry["command"] = build_native_command(entry)
+    else:
+        try:
+            size = get_device_size(device)
+        except OSError:
+            size = None
+        entry["command"] = build_dd_command(
+            if_device, device, flags, continuous_write, size
+        )
+    return entry
+
+
+# Generate a fresh per-pass seed, stored as hex in the schema
+def new_seed():
+    return os.urandom(32).hex()
+
+
+# Seed a seeded pass uses in schema run `run`: the first run uses the pass's
+# own seed and later runs a hash of it and the run number, so repeated runs
+# write different data that verify passes can still regenerate
+def run_seed(seed, run):
+    if run <= 1:
+        return seed
+    return hashlib.sha256(bytes.fromhex(seed) + run.to_bytes(8, "little")).hexdigest()
+
+
+# Ask for a seed, generating one if none is given
+def get_seed():
+    seed = input("Enter seed in hex or press Enter to generate one: ").strip()
+    if not seed:
+        return new_seed()
+    try:
+        bytes.fromhex(seed)
+    except ValueError:
+        print("Invalid hex seed. Generating one instead.")
+        return new_seed()
+    return seed
+
+
+# Ask which engine should run a pass
+def get_engine():
+    choice = (
+        input(
+            f"Write engine: (d)d, (n)ative or (a)sync? [default: {DEFAULT_ENGINE}]: "
+        )
+        .strip()
+        .lower()
+    )
+    if not choice:
+        return DEFAULT_ENGINE
+    if choice.startswith("n"):
+        return "native"
+    return "async" if choice.startswith("a") else "dd"
+
+
+# Ask how many writes the async engine should keep in flight
+def get_queue_depth(engine):
+    if engine != "async":
+        return None
+    depth = input(f"Queue depth (default: {DEFAULT_QUEUE_DEPTH}): ").strip()
+    try:
+        return max(1, int(depth)) if depth else DEFAULT_QUEUE_DEPTH
+    except ValueError:
+        print(f"Invalid number. Using a queue depth of {DEFAULT_QUEUE_DEPTH}.")
+        return DEFAULT_QUEUE_DEPTH
+
+
+# Ask how many parallel region writers an in-process engine should use
+def get_regions(engine, device=None):
+    if engine not in IN_PROCESS_ENGINES:
+        return 1
+    regions = input("Parallel region writers (default: 1): ").strip()
+    try:
+        regions = max(1, int(regions)) if regions else 1
+    except ValueError:
+        print("Invalid number. Using a single writer.")
+        return 1
+    topology = probe_topology(device) if device else None
+    if regions > 1 and topology and topology["rotational"]:
+        print("Note: parallel regions make a rotational disk seek between them.")
+    return regions
+
+
+# Ask whether an in-process pass should tune its block size and queue depth
+def get_autotune(engine):
+    if engine not in IN_PROCESS_ENGINES:
+        return False
+    answer = input("Autotune block size and queue depth before the pass? [y/N]: ")
+    return answer.strip().lower() == "y"
+
+
+# Ask whether an in-process pass should skip unwritable sectors
+def get_tolerant(engine):
+    if engine not in IN_PROCESS_ENGINES:
+        return False
+    answer = input("Skip unwritable sectors instead of failing the pass? [y/N]: ")
+    return answer.strip().lower() == "y"
+
+
+# Ask how many random blocks to read back after a discard
+def get_sample_count():
+    count = input("Sample-read how many random blocks afterwards? (default: 0): ")
+    try:
+        return max(0, int(count.strip())) if count.strip() else 0
+    except ValueError:
+        print("Invalid number. Skipping the sample read.")
+        return 0
+
+
+# Default dd flags for a device, with bs= taken from its topology
+def default_dd_flags(device=None):
+    block_size, _ = choose_geometry(probe_topology(device) if device else None)
+    return DEFAULT_DD_FLAGS.replace("bs=4M", f"bs={format_size(block_size)}", 1)
+
+
+# Ask for dd flags, which only apply to the dd engine
+def get_flags(engine, device=None):
+    if engine != "dd":
+        return None
+    default = default_dd_flags(device)
+    return (
+        input(f"Enter dd flags or press Enter for default [{default}]: ").strip()
+        or default
+    )
+
+
+# Write `content` tiled to exactly `size` bytes, one fixed-size chunk at a time
+def write_tiled_file(filename, content, size):
+    fill = make_pattern_filler(content)
+    chunk = bytearray(NATIVE_BLOCK_SIZE)
+    view = memoryview(chunk)
+    with open(filename, "wb") as f:
+        offset = 0
+        while offset < size:
+            n = min(len(chunk), size - offset)
+            fill(view[:n], offset)
+            f.write(view[:n])
+            offset += n
+
+
+def create_data_file():
+    print("\n\033[1mCreate Custom Data File:\033[0m")
+
+    # Get content
+    user_input = input("Enter file content (default: All binary ones): ").strip()
+    content = (
+        b"\xFF" if not user_input or user_input.upper() == "FF" else user_input.encode()
+    )
+
+    # Get file size
+    size_mb = input("Enter file size in MB (default: 128MB): ").strip()
+    try:
+        size_mb = int(size_mb) if size_mb else 128
+    except ValueError:
+        print("Invalid size input. Using default 128MB.")
+        size_mb = 128
+
+    # Get filename (with default)
+    default_name = f"gen_{int(time.time())}.tmp"
+    filename = (
+        input(f"Enter filename (default: {default_name}): ").strip() or default_name
+    )
+
+    # Get cleanup preference
+    cleanup = (
+        input("Remove file after script completion? [Y/n]: ").strip().lower() != "n"
+    )
+
+    # Create the file
+    write_tiled_file(filename, content, size_mb * 1024 * 1024)
+
+    if cleanup:
+        temp_files.append(filename)
+
+    print(f"\nCreated file: {filename}")
+    print(f"Size: {size_mb}MB")
+    print(f"Cleanup on exit: {'Yes' if cleanup else 'No'}")
+
+    # Offer to add to schema with automatic path selection
+    if input("\nAdd this file to schema? [Y/n]: ").strip().lower() != "n":
+        device = get_device()
+        if device:
+            write_mode = (
+                input("Write source: (o)nce or (c)ontinuously? ").strip().lower()
+            )
+            continuous_write = write_mode.startswith("c")
+
+            engine = get_engine()
+            flags = get_flags(engine, device)
+            regions = get_regions(engine, device)
+            queue_depth = get_queue_depth(engine)
+
+            schema_sources.append(
+                make_schema_entry(
+                    device,
+                    "path",
+                    filename,
+                    continuous_write,
+                    engine,
+                    flags,
+                    regions=regions,
+                    queue_depth=queue_depth,
+                )
+            )
+            print("Source added successfully.")
+
+
+# Parse a dd status line (GNU or BSD format) into a progress event
+def parse_dd_progress(line):
+    match = DD_PROGRESS.search(line)
+    if not match:
+        return None
+    written = int(match.group(1))
+    seconds = float(match.group(2).replace(",", "."))
+    return {
+        "bytes": written,
+        "seconds": seconds,
+        "rate": written / seconds if seconds > 0 else 0.0,
+    }
+
+
+# Identify a file so open descriptors on it can be recognised
+def file_identity(path):
+    st = os.stat(path)
+    if stat.S_ISBLK(st.st_mode):
+        return ("block", st.st_rdev)
+    return ("file", st.st_dev, st.st_ino)
+
+
+# List a process and all of its descendants from /proc
+def process_tree(root_pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after ")"
+                ppid = int(f.read().rpartition(")")[2].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, queue = [], [root_pid]
+    while queue:
+        pid = queue.pop()
+        tree.append(pid)
+        queue.extend(children.get(pid, []))
+    return tree
+
+
+# Find (pid, fd) of a process in the tree that has the target open for writing
+def find_writer(root_pid, identity):
+    for pid in process_tree(root_pid):
+        try:
+            fds = os.listdir(f"/proc/{pid}/fd")
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                if file_identity(f"/proc/{pid}/fd/{fd}") != identity:
+                    continue
+                with open(f"/proc/{pid}/fdinfo/{fd}") as f:
+                    info = dict(line.split(":", 1) for line in f if ":" in line)
+            except OSError:
+                continue
+            if int(info.get("flags", "0").strip(), 8) & (os.O_WRONLY | os.O_RDWR):
+                return pid, fd
+    return None
+
+
+# Read how far a writer got from the kernel: the descriptor's file position,
+# or the process's write count if it writes with pwrite
+def read_writer_position(pid, fd):
+    try:
+        with open(f"/proc/{pid}/fdinfo/{fd}") as f:
+            for line in f:
+                if line.startswith("pos:"):
+                    position = int(line.split()[1])
+                    break
+            else:
+                position = 0
+        if position:
+            return position
+        with open(f"/proc/{pid}/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+# Sample a subprocess's progress on the target from /proc (Linux only)
+def make_kernel_sampler(root_pid, device):
+    if not device or not os.path.isdir(f"/proc/{root_pid}"):
+        return None
+    try:
+        identity = file_identity(device)
+    except OSError:
+        return None
+    writer = None
+
+    def sample():
+        nonlocal writer
+        if writer is None or not os.path.exists(f"/proc/{writer[0]}"):
+            writer = find_writer(root_pid, identity)
+        if writer is None:
+            return None
+        return read_writer_position(*writer)
+
+    return sample
+
+
+# Run a shell command, following its stderr without blocking. dd separates
+# status updates with carriage returns, so output is split on \r and \n.
+# The latest progress event is kept in `progress` when a dict is given, with
+# bytes counted from the start of the device for commands resumed at `offset`.
+# `checkpoint` is called with the bytes reached every JOURNAL_INTERVAL.
+def execute_command(
+    command, device=None, feed=None, progress=None, offset=0, checkpoint=None
+):
+    try:
+        process = subprocess.Popen(
+            command,
+            shell=True,
+            stdin=subprocess.PIPE if feed else None,
+            stderr=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        if feed:
+            repeater = threading.Thread(
+                target=feed_pipe, args=(feed, process.stdin, offset), daemon=True
+            )
+            repeater.start()
+
+        # Prefer exact counters from the kernel over dd's own status lines
+        sample = make_kernel_sampler(process.pid, device)
+        try:
+            size = get_device_size(device) if device else None
+        except OSError:
+            size = None
+        if progress is None:
+            progress = {}
+        started = last_sample = last_checkpoint = time.time()
+        kernel_progress = False
+
+        stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+        pending = b""
+        selector = selectors.DefaultSelector()
+        selector.register(process.stderr, selectors.EVENT_READ)
+        selector.register(process.stdout, selectors.EVENT_READ)
+        while selector.get_map():
+            if stop_event.is_set() and process.poll() is None:
+                process.terminate()
+            if sample and time.time() - last_sample >= 1:
+                last_sample = time.time()
+                # The descriptor position already includes the seek offset
+                written = sample()
+                if written is not None:
+                    kernel_progress = True
+                    elapsed = last_sample - started
+                    progress.update(
+                        bytes=written,
+                        seconds=elapsed,
+                        rate=(written - offset) / elapsed if elapsed > 0 else 0.0,
+                    )
+                    print_progress(
+                        device, written, started, "written", size, offset
+                    )
+            if checkpoint and time.time() - last_checkpoint >= JOURNAL_INTERVAL:
+                last_checkpoint = time.time()
+                checkpoint(progress.get("bytes", offset))
+            for key, _ in selector.select(timeout=1):
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    if key.fileobj is process.stderr and pending:
+                        data, pending = pending + b"\n", b""
+                    else:
+                        continue
+                if key.fileobj is not process.stderr:
+                    continue  # dd writes nothing useful to stdout
+                *lines, pending = re.split(rb"[\r\n]", pending + data)
+                for raw in lines:
+                    line = raw.decode(errors="replace").strip()
+                    if not line:
+                        continue
+                    stderr_tail.append(line)
+                    event = parse_dd_progress(line)
+                    if event:
+                        event["bytes"] += offset
+                        progress.update(event)
+                    if event and kernel_progress:
+                        continue
+                    report_progress(device, line)
+        selector.close()
+        process.wait()
+
+        end_progress()
+        if process.returncode == 0:
+            return True, None
+        if size and progress.get("bytes", 0) >= size:
+            # Commands without a size bound stop with an error once the device
+            # is full; only the byte count decides whether that is success
+            print("Drive full - pass completed successfully!")
+            return True, None
+        if stderr_tail:
+            return False, f"Command failed: {stderr_tail[-1]}"
+        return False, "Command failed"
+    except Exception as e:
+        return False, str(e)
+
+
+# Feed a repeating source into a pipe, starting at the source data for target
+# `offset`, until the reader goes away
+def feed_pipe(source_info, pipe, offset=0):
+    if sys.platform.startswith("linux"):
+        try:
+            fcntl.fcntl(pipe.fileno(), F_SETPIPE_SZ, PIPE_SIZE)
+        except OSError:
+            pass  # Above /proc/sys/fs/pipe-max-size; keep the default
+    fill, close_source = make_filler(source_info)
+    buffer = bytearray(NATIVE_BLOCK_SIZE)
+    view = memoryview(buffer)
+    try:
+        while not stop_event.is_set():
+            n = fill(view, offset)
+            if n == 0:
+                break
+            throttle(source_info["device"], n)
+            written = 0
+            while written < n:
+                written += os.write(pipe.fileno(), view[written:n])
+            offset += n
+    except OSError:
+        pass  # dd exited, normally because the device is full
+    finally:
+        view.release()
+        pipe.close()
+        close_source()
+
+
+# Open the target for writing, bypassing the page cache where supported
+def open_target(of_device, access=os.O_WRONLY):
+    if hasattr(os, "O_DIRECT"):
+        try:
+            return os.open(of_device, access | os.O_DIRECT), True
+        except OSError as e:
+            # Some filesystems (e.g. tmpfs) refuse O_DIRECT
+            if e.errno != errno.EINVAL:
+                raise
+    return os.open(of_device, access), False
+
+
+# Read into a buffer at a given offset, falling back where preadv is missing
+def read_into(fd, view, offset):
+    if hasattr(os, "preadv"):
+        return os.preadv(fd, [view], offset)
+    data = os.pread(fd, len(view), offset)
+    view[: len(data)] = data
+    return len(data)
+
+
+# Expand a seed into keystream chunk `index` (SHAKE-128 in counter mode)
+def keystream_chunk(seed, index, size=RANDOM_CHUNK_SIZE):
+    return hashlib.shake_128(seed + index.to_bytes(8, "little")).digest(size)
+
+
+# Return a fill function producing the keystream of `seed` at any offset
+def make_keystream_filler(seed):
+    def fill_keystream(view, offset):
+        total = 0
+        while total < len(view):
+            index, skip = divmod(offset + total, RANDOM_CHUNK_SIZE)
+            n = min(RANDOM_CHUNK_SIZE - skip, len(view) - total)
+            chunk = memoryview(keystream_chunk(seed, index))
+            view[total : total + n] = chunk[skip : skip + n]
+            total += n
+        return total
+
+    return fill_keystream
+
+
+# Generate `size` keystream bytes starting at `offset` (runs in worker processes)
+def keystream_block(seed, offset, size):
+    block = bytearray(size)
+    make_keystream_filler(seed)(memoryview(block), offset)
+    return block
+
+
+# Keep workers from reacting to Ctrl-C; the parent handles cleanup
+def ignore_sigint():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+# Return (fill, close) for a keystream generated by a pool of worker processes.
+# Each block is an independent counter range; a ring of pending blocks, two
+# per worker and at most RANDOM_RING_BYTES, is kept ahead of the writer and
+# drained in order.
+def make_parallel_keystream_filler(seed, workers=None, depth=None):
+    workers = workers or random_workers or RANDOM_WORKERS
+    depth = depth or 2 * workers
+    if workers <= 1:
+        return make_keystream_filler(seed), (lambda: None)
+
+    pool = concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=ignore_sigint
+    )
+    ring = collections.deque()
+
+    def fill_parallel(view, offset):
+        size = len(view)
+        if ring and ring[0][:2] != (offset, size):
+            # Out-of-order request (e.g. a seek); drop the prefetched blocks
+            for pending in ring:
+                pending[2].cancel()
+            ring.clear()
+        next_offset = ring[-1][0] + size if ring else offset
+        while len(ring) < max(min(depth, RANDOM_RING_BYTES // size), 1):
+            future = pool.submit(keystream_block, seed, next_offset, size)
+            ring.append((next_offset, size, future))
+            next_offset += size
+        view[:] = ring.popleft()[2].result()
+        return size
+
+    return fill_parallel, (lambda: pool.shutdown(cancel_futures=True))
+
+
+# Measure keystream generation throughput for an increasing number of workers
+def benchmark_random(total_mb=256):
+    seed = os.urandom(32)
+    buffer = bytearray(NATIVE_BLOCK_SIZE)
+    view = memoryview(buffer)
+    blocks = max(1, total_mb * 1024 * 1024 // NATIVE_BLOCK_SIZE)
+    total = blocks * NATIVE_BLOCK_SIZE
+    counts = sorted({1, 2, 4, 8, 16, 32, RANDOM_WORKERS})
+    print(f"\033[1mKeystream benchmark ({total // 2**20} MB per run):\033[0m")
+    for workers in (n for n in counts if n <= RANDOM_WORKERS):
+        fill, close = make_parallel_keystream_filler(seed, workers)
+        try:
+            fill(view, 0)  # Start the pool before timing
+            started = time.time()
+            for i in range(1, blocks + 1):
+                fill(view, i * NATIVE_BLOCK_SIZE)
+            elapsed = time.time() - started
+        finally:
+            close()
+        print(f"{workers: >3} worker(s): {total / elapsed / 1e6:.0f} MB/s")
+
+
+# Return a fill function that tiles `pattern` across the target offsets
+def make_pattern_filler(pattern):
+    # One tile long enough to serve any block from any phase of the pattern
+    repeats = NATIVE_BLOCK_SIZE // len(pattern) + 2
+    tile = memoryview(pattern * repeats)
+    span = len(tile) - len(pattern)
+
+    def fill_pattern(view, offset):
+        total = 0
+        while total < len(view):
+            phase = (offset + total) % len(pattern)
+            n = min(span, len(view) - total)
+            view[total : total + n] = tile[phase : phase + n]
+            total += n
+        return total
+
+    return fill_pattern
+
+
+# Return (fill, close) for a source; fill(view, offset) puts the source data
+# for the given target offset into view and returns how many bytes are valid
+def make_filler(source_info, workers=None):
+    source = source_info["source"]
+    continuous_write = source_info.get("continuous_write", False)
+
+    if source_info.get("pattern"):
+        return make_pattern_filler(bytes.fromhex(source_info["pattern"])), (
+            lambda: None
+        )
+
+    if source == KEYSTREAM:
+        seed = source_info.get("seed")
+        run = journal["run"] if journal is not None else 1
+        seed = bytes.fromhex(run_seed(seed, run)) if seed else os.urandom(32)
+        return make_parallel_keystream_filler(seed, workers)
+
+    if source == "/dev/zero":
+        # Anonymous mmap buffers start out zeroed and are never dirtied
+        return (lambda view, offset: len(view)), (lambda: None)
+
+    fd = os.open(source, os.O_RDONLY)
+    mode = os.fstat(fd).st_mode
+
+    if not (stat.S_ISREG(mode) or stat.S_ISBLK(mode)):
+        # Character devices and pipes are read as plain streams
+        def fill_stream(view, offset):
+            total = 0
+            while total < len(view):
+                n = os.readv(fd, [view[total:]])
+                if n == 0:
+                    break
+                total += n
+            return total
+
+        return fill_stream, (lambda: os.close(fd))
+
+    size = os.lseek(fd, 0, os.SEEK_END)
+
+    if continuous_write and stat.S_ISREG(mode) and size:
+        # Repeated files are read once: small ones are tiled like a pattern,
+        # larger ones are mapped and copied around the wrap point
+        if size < NATIVE_BLOCK_SIZE:
+            data = bytearray(size)
+            read_into(fd, memoryview(data), 0)
+            os.close(fd)
+            return make_pattern_filler(bytes(data)), (lambda: None)
+        mapped = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        mapped_view = memoryview(mapped)
+
+        def fill_mapped(view, offset):
+            total = 0
+            while total < len(view):
+                phase = (offset + total) % size
+                n = min(size - phase, len(view) - total)
+                view[total : total + n] = mapped_view[phase : phase + n]
+                total += n
+            return total
+
+        def close_mapped():
+            mapped_view.release()
+            mapped.close()
+            os.close(fd)
+
+        return fill_mapped, close_mapped
+
+    def fill_file(view, offset):
+        total = 0
+        while total < len(view):
+            position = offset + total
+            if continuous_write and size:
+                position %= size
+            n = read_into(fd, view[total:], position)
+            if n == 0:
+                break
+            total += n
+        return total
+
+    return fill_file, (lambda: os.close(fd))
+
+
+# pwrite the whole view; returns (bytes written, device full)
+def write_all(fd, view, offset):
+    total = 0
+    while total < len(view):
+        try:
+            n = os.pwrite(fd, view[total:], offset + total)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                return total, True
+            raise
+        if n == 0:
+            return total, True
+        total += n
+    return total, False
+
+
+# pwrite the view, bisecting any range that fails with EIO down to `sector`
+# bytes; unwritable sectors are marked skipped in the device's extent map.
+# Returns (bytes written or skipped, device full).
+def write_skipping_bad(fd, view, offset, sector, device):
+    try:
+        return write_all(fd, view, offset)
+    except OSError as e:
+        if e.errno != errno.EIO:
+            raise
+    if len(view) <= sector:
+        mark_extent(device, "skipped", offset, offset + len(view))
+        return len(view), False
+    half = max(len(view) // 2 // sector * sector, sector)
+    first, full = write_skipping_bad(fd, view[:half], offset, sector, device)
+    if full:
+        return first, True
+    second, full = write_skipping_bad(fd, view[half:], offset + half, sector, device)
+    return first + second, full
+
+
+# Read into the view, bisecting any range that fails with EIO down to
+# `sector` bytes; unreadable sectors are added to the `unreadable` extent set
+# and left unchanged in the view. Returns the bytes read or skipped.
+def read_skipping_bad(fd, view, offset, sector, unreadable):
+    try:
+        return read_into(fd, view, offset)
+    except OSError as e:
+        if e.errno != errno.EIO:
+            raise
+    if len(view) <= sector:
+        extent_add(unreadable, offset, offset + len(view))
+        return len(view)
+    half = max(len(view) // 2 // sector * sector, sector)
+    first = read_skipping_bad(fd, view[:half], offset, sector, unreadable)
+    if first < half:
+        return first
+    return first + read_skipping_bad(
+        fd, view[half:], offset + half, sector, unreadable
+    )
+
+
+# An empty interval set: sorted, disjoint [start, end) extents kept as two
+# parallel arrays of 64-bit offsets (16 bytes per extent)
+def new_extent_set():
+    return array.array("Q"), array.array("Q")
+
+
+# Add [start, end) to an interval set, merging overlapping and adjacent
+# extents; the affected extents are found by binary search
+def extent_add(extents, start, end):
+    if start >= end:
+        return
+    starts, ends = extents
+    first = bisect.bisect_left(ends, start)
+    last = bisect.bisect_right(starts, end)
+    if first < last:
+        start = min(start, starts[first])
+        end = max(end, ends[last - 1])
+    starts[first:last] = array.array("Q", [start])
+    ends[first:last] = array.array("Q", [end])
+
+
+# Remove [start, end) from an interval set, trimming the extents it cuts
+def extent_remove(extents, start, end):
+    if start >= end:
+        return
+    starts, ends = extents
+    first = bisect.bisect_right(ends, start)
+    last = bisect.bisect_left(starts, end)
+    if first >= last:
+        return
+    kept_starts, kept_ends = array.array("Q"), array.array("Q")
+    if starts[first] < start:
+        kept_starts.append(starts[first])
+        kept_ends.append(start)
+    if ends[last - 1] > end:
+        kept_starts.append(end)
+        kept_ends.append(ends[last - 1])
+    starts[first:last] = kept_starts
+    ends[first:last] = kept_ends
+
+
+# End of the covered run containing `offset`, or `offset` if it is not covered
+def extent_reach(extents, offset):
+    starts, ends = extents
+    index = bisect.bisect_right(starts, offset) - 1
+    if index >= 0 and ends[index] > offset:
+        return ends[index]
+    return offset
+
+
+# List the extents of an interval set as (start, end) pairs
+def extent_list(extents):
+    return list(zip(*extents))
+
+
+# Encode an interval set as base64 little-endian start and end arrays
+def encode_extents(extents):
+    encoded = []
+    for values in extents:
+        values = array.array("Q", values)
+        if sys.byteorder == "big":
+            values.byteswap()
+        encoded.append(base64.b64encode(values.tobytes()).decode())
+    return encoded
+
+
+# Decode an interval set written by encode_extents
+def decode_extents(encoded):
+    extents = new_extent_set()
+    for values, data in zip(extents, encoded):
+        values.frombytes(base64.b64decode(data))
+        if sys.byteorder == "big":
+            values.byteswap()
+    return extents
+
+
+# The interval set of one state of a device, created on first use
+def device_extents(device, state):
+    with extent_lock:
+        states = extent_maps.setdefault(device, {})
+        return states.setdefault(state, new_extent_set())
+
+
+# Mark [start, end) of a device with a state
+def mark_extent(device, state, start, end):
+    extents = device_extents(device, state)
+    with extent_lock:
+        extent_add(extents, start, end)
+
+
+# Clear [start, end) of a device from a state
+def unmark_extent(device, state, start, end):
+    extents = device_extents(device, state)
+    with extent_lock:
+        extent_remove(extents, start, end)
+
+
+# Forget everything known about a device before a fresh write pass
+def clear_extents(device):
+    with extent_lock:
+        extent_maps[device] = {}
+
+
+# Mark the durable part of every region as written
+def record_written(device, regions):
+    for region in regions:
+        mark_extent(device, "written", region["start"], region["durable"])
+
+
+# Print how much of each device is written, verified, failed and skipped,
+# listing the failed and skipped extents
+def print_extent_report():
+    for device in list(extent_maps):
+        print(f"\n\033[1mExtent map of {device}:\033[0m")
+        for state in EXTENT_STATES:
+            with extent_lock:
+                extents = extent_list(device_extents(device, state))
+            total = sum(end - start for start, end in extents)
+            print(f"  {state: <8} {total} bytes in {len(extents)} extent(s)")
+            if state in ("failed", "skipped"):
+                print_extents(extents)
+
+
+# Parse a bandwidth such as 200M or 50M/s into bytes per second; 0 and "off"
+# mean unlimited. Returns None if the value is invalid.
+def parse_rate(value):
+    value = str(value).strip()
+    if value.lower() == "off":
+        return 0
+    return parse_dd_size(value.removesuffix("/s"))
+
+
+# Describe a bandwidth limit
+def format_rate(rate):
+    return f"{format_size(rate)}/s" if rate else "unlimited"
+
+
+# Describe the bandwidth limits in force
+def describe_rate_limits():
+    with rate_lock:
+        limits = dict(rate_limits)
+    described = [
+        f"global {format_rate(limits.pop('global'))}",
+        f"per device {format_rate(limits.pop('jobs'))}",
+    ]
+    described += [f"{device} {format_rate(rate)}" for device, rate in limits.items()]
+    return ", ".join(described)
+
+
+# Check whether passes should be throttled: a limit is set or may be set at
+# runtime through the control file
+def rate_limiting_enabled():
+    with rate_lock:
+        limited = any(rate_limits.values())
+    return limited or os.path.exists(rate_control_path)
+
+
+# Bandwidth limit of a bucket; devices without their own limit use the jobs one
+def limit_for(key):
+    return rate_limits.get(key, rate_limits["jobs"])
+
+
+# A token bucket refilled at `rate` bytes per second
+def new_bucket(rate):
+    return {
+        "rate": rate,
+        "tokens": rate * RATE_BURST,
+        "stamp": time.monotonic(),
+        "lock": threading.Lock(),
+    }
+
+
+# Get the bucket of "global" or a device, creating it on first use
+def rate_bucket(key):
+    with rate_lock:
+        if key not in rate_buckets:
+            rate_buckets[key] = new_bucket(limit_for(key))
+        return rate_buckets[key]
+
+
+# Set the limit of "global", "jobs" or a device and retune the buckets it
+# governs; running passes follow the new rate from their next block
+def set_rate_limit(target, rate):
+    with rate_lock:
+        rate_limits[target] = rate
+        for key, bucket in rate_buckets.items():
+            with bucket["lock"]:
+                bucket["rate"] = limit_for(key)
+                bucket["tokens"] = min(bucket["tokens"], bucket["rate"] * RATE_BURST)
+
+
+# Take n bytes' worth of tokens, going into debt when the bucket runs dry so
+# blocks larger than the burst still pass; returns the seconds to wait
+def take_tokens(bucket, n):
+    with bucket["lock"]:
+        rate = bucket["rate"]
+        if not rate:
+            return 0
+        now = time.monotonic()
+        tokens = bucket["tokens"] + (now - bucket["stamp"]) * rate
+        bucket["tokens"] = min(tokens, rate * RATE_BURST) - n
+        bucket["stamp"] = now
+        return max(-bucket["tokens"] / rate, 0)
+
+
+# Wait until n more bytes fit within the device's and the global limit
+def throttle(device, n):
+    delay = max(
+        take_tokens(rate_bucket("global"), n), take_tokens(rate_bucket(device), n)
+    )
+    if delay:
+        stop_event.wait(delay)
+
+
+# Apply the limits in the control file: one "<target> <rate>" per line, where
+# target is global, jobs (every device without its own limit) or a device
+def read_rate_control(path):
+    with open(path) as f:
+        lines = f.read().splitlines()
+    targets = {"global", "jobs"} | {entry["device"] for entry in schema_sources}
+    for line in lines:
+        words = line.split("#")[0].split()
+        if not words:
+            continue
+        rate = parse_rate(words[1]) if len(words) == 2 else None
+        if rate is None:
+            print(f"\nIgnoring {line.strip()!r} in {path}: expected <target> <rate>")
+            continue
+        if words[0] not in targets:
+            print(
+                f"\nIgnoring {line.strip()!r} in {path}: the target must be "
+                "global, jobs or a device of the schema"
+            )
+            continue
+        set_rate_limit(words[0], rate)
+    print(f"\nBandwidth limits: {describe_rate_limits()}")
+
+
+# Re-read the control file whenever it changes, until `done` is set
+def watch_rate_control(done):
+    seen = None
+    while True:
+        try:
+            status = os.stat(rate_control_path)
+            stamp = (status.st_mtime_ns, status.st_size)
+        except OSError:
+            stamp = None
+        if stamp is not None and stamp != seen:
+            try:
+                read_rate_control(rate_control_path)
+            except OSError as e:
+                print(f"\nCould not read {rate_control_path}: {e}")
+        seen = stamp
+        if done.wait(RATE_CONTROL_INTERVAL):
+            return
+
+
+# Flush written data to stable storage
+def sync_target(fd):
+    if hasattr(os, "fdatasync"):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+
+# Show a progress line, or post it to the status board during parallel runs
+def report_progress(device, line):
+    if status_board is None:
+        print(line, end="\r")
+    elif device in status_board:
+        status_board[device][1] = line
+
+
+# Finish the current progress line
+def end_progress():
+    if status_board is None:
+        print()
+
+
+# Report dd-style progress for a device, with percentage and ETA when the
+# total size is known; `resumed` bytes were written before `started`
+def print_progress(device, written, started, verb="copied", size=None, resumed=0):
+    elapsed = max(time.time() - started, 1e-6)
+    rate = (written - resumed) / elapsed
+    line = f"{written} bytes ({written / 1e6:.0f} MB) {verb}"
+    if size:
+        line += f" ({min(written / size, 1) * 100:.1f}%)"
+    line += f", {elapsed:.0f} s, {rate / 1e6:.1f} MB/s"
+    if size and rate > 0 and written < size:
+        eta = int((size - written) / rate)
+        line += f", ETA {eta // 3600}:{eta // 60 % 60:02}:{eta % 60:02}"
+    report_progress(device, line)
+
+
+# Stop long-running loops once the run is interrupted
+def check_interrupted():
+    if stop_event.is_set():
+        raise InterruptedError(errno.EINTR, "Interrupted")
+
+
+# Return the size in bytes of a block device or file
+def get_device_size(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        mode = os.fstat(fd).st_mode
+        if stat.S_ISREG(mode):
+            return os.fstat(fd).st_size
+        if stat.S_ISBLK(mode) and sys.platform.startswith("linux"):
+            size = bytearray(8)
+            fcntl.ioctl(fd, BLKGETSIZE64, size)
+            return int.from_bytes(size, sys.byteorder)
+        return os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
+
+
+# Split a device into contiguous, block-aligned regions, one per writer
+def plan_regions(size, count, block_size=NATIVE_BLOCK_SIZE):
+    step = -(-size // max(count, 1))
+    step += -step % block_size
+    return [
+        {
+            "start": start,
+            "end": min(start + step, size),
+            "offset": start,
+            "durable": start,
+            "done": False,
+            "error": None,
+            "retries": 0,
+            "stalls": 0,
+        }
+        for start in range(0, size, max(step, block_size))
+    ]
+
+
+# Write one region of a pass; progress is kept in region["offset"]
+def write_region(source_info, region, workers=None):
+    device = source_info["device"]
+    end = region["end"]
+    try:
+        fill, close_source = make_filler(source_info, workers)
+    except OSError as e:
+        region["error"] = f"Cannot open source: {e}"
+        return
+    try:
+        fd, direct = open_target(device)
+    except OSError as e:
+        close_source()
+        region["error"] = str(e)
+        return
+
+    alignment = source_info.get("alignment", DIRECT_IO_ALIGNMENT)
+    tolerant = source_info.get("tolerant")
+    buffer = mmap.mmap(-1, source_info.get("block_size", NATIVE_BLOCK_SIZE))
+    view = memoryview(buffer)
+    offset = region["offset"]
+    try:
+        while offset < end:
+            check_interrupted()
+            wanted = min(len(view), end - offset)
+            n = fill(view[:wanted], offset)
+            if n == 0:
+                break
+            if direct and n % alignment:
+                # O_DIRECT cannot write an unaligned tail; finish through the cache
+                os.close(fd)
+                fd, direct = os.open(device, os.O_WRONLY), False
+            throttle(device, n)
+            check_interrupted()
+            if tolerant:
+                written, full = write_skipping_bad(
+                    fd, view[:n], offset, alignment, device
+                )
+            else:
+                written, full = write_all(fd, view[:n], offset)
+            offset += written
+            region["offset"] = offset
+            if full:
+                raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+            if n < wanted:
+                break
+        sync_target(fd)
+        region["durable"] = offset
+        region["done"] = True
+    except OSError as e:
+        region["error"] = f"{e.strerror} at offset {offset}"
+    finally:
+        view.release()
+        buffer.close()
+        os.close(fd)
+        close_source()
+
+
+# Load the C library on first use
+def load_libc():
+    global libc
+    if libc is None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.syscall.restype = ctypes.c_long
+        libc.fallocate.argtypes = (
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_int64,
+            ctypes.c_int64,
+        )
+    return libc
+
+
+# Call a raw Linux system call through libc, raising OSError on failure
+def raw_syscall(number, *args):
+    while True:
+        result = load_libc().syscall(
+            ctypes.c_long(number), *map(ctypes.c_long, args)
+        )
+        if result >= 0:
+            return result
+        err = ctypes.get_errno()
+        if err != errno.EINTR:
+            raise OSError(err, os.strerror(err))
+
+
+# Pin buffers for the kernel; returns (exports, addresses)
+def export_buffers(buffers):
+    exports = [(ctypes.c_char * len(buffer)).from_buffer(buffer) for buffer in buffers]
+    return exports, [ctypes.addressof(export) for export in exports]
+
+
+# Set up an io_uring with the buffers registered as fixed buffers
+def uring_open(depth, buffers):
+    params = (ctypes.c_char * 120)()
+    fd = raw_syscall(IO_URING_SETUP, depth, ctypes.addressof(params))
+    ring = {"fd": fd, "maps": [], "to_submit": 0}
+    try:
+        sq_entries, cq_entries = struct.unpack_from("<II", params, 0)
+        features = struct.unpack_from("<I", params, 20)[0]
+        # head, tail, ring_mask, ring_entries, flags, dropped, array
+        ring["sq_off"] = struct.unpack_from("<7I", params, 40)
+        # head, tail, ring_mask, ring_entries, overflow, cqes
+        ring["cq_off"] = struct.unpack_from("<6I", params, 80)
+        sq_size = ring["sq_off"][6] + sq_entries * 4
+        cq_size = ring["cq_off"][5] + cq_entries * IO_URING_CQE.size
+        access = {"flags": mmap.MAP_SHARED, "prot": mmap.PROT_READ | mmap.PROT_WRITE}
+        if features & IORING_FEAT_SINGLE_MMAP:
+            sq_size = cq_size = max(sq_size, cq_size)
+            ring["sq"] = ring["cq"] = mmap.mmap(fd, sq_size, **access)
+            ring["maps"].append(ring["sq"])
+        else:
+            ring["sq"] = mmap.mmap(fd, sq_size, offset=IORING_OFF_SQ_RING, **access)
+            ring["cq"] = mmap.mmap(fd, cq_size, offset=IORING_OFF_CQ_RING, **access)
+            ring["maps"] += [ring["sq"], ring["cq"]]
+        ring["sqes"] = mmap.mmap(
+            fd, sq_entries * IO_URING_SQE.size, offset=IORING_OFF_SQES, **access
+        )
+        ring["maps"].append(ring["sqes"])
+        ring["sq_mask"] = struct.unpack_from("<I", ring["sq"], ring["sq_off"][2])[0]
+        ring["cq_mask"] = struct.unpack_from("<I", ring["cq"], ring["cq_off"][2])[0]
+
+        ring["exports"], ring["addresses"] = export_buffers(buffers)
+        iovecs = (ctypes.c_uint64 * (2 * len(buffers)))()
+        for index, buffer in enumerate(buffers):
+            iovecs[2 * index] = ring["addresses"][index]
+            iovecs[2 * index + 1] = len(buffer)
+        raw_syscall(
+            IO_URING_REGISTER,
+            fd,
+            IORING_REGISTER_BUFFERS,
+            ctypes.addressof(iovecs),
+            len(buffers),
+        )
+    except Exception:
+        uring_close(ring)
+        raise
+    return ring
+
+
+# Queue a write from fixed buffer `index`; it is submitted by the next reap
+def uring_submit(ring, index, fd, offset, length):
+    sq, sq_off = ring["sq"], ring["sq_off"]
+    tail = struct.unpack_from("<I", sq, sq_off[1])[0]
+    slot = tail & ring["sq_mask"]
+    IO_URING_SQE.pack_into(
+        ring["sqes"],
+        slot * IO_URING_SQE.size,
+        IORING_OP_WRITE_FIXED,
+        0,
+        0,
+        fd,
+        offset,
+        ring["addresses"][index],
+        length,
+        0,
+        index,
+        index,
+        0,
+        0,
+        0,
+        0,
+    )
+    struct.pack_into("<I", sq, sq_off[6] + slot * 4, slot)
+    struct.pack_into("<I", sq, sq_off[1], (tail + 1) & 0xFFFFFFFF)
+    ring["to_submit"] += 1
+
+
+# Submit queued writes, wait for at least `wait` completions and return
+# them as (index, result) pairs
+def uring_reap(ring, wait):
+    submitted = raw_syscall(
+        IO_URING_ENTER,
+        ring["fd"],
+        ring["to_submit"],
+        wait,
+        IORING_ENTER_GETEVENTS,
+        0,
+        0,
+    )
+    ring["to_submit"] -= submitted
+    cq, cq_off = ring["cq"], ring["cq_off"]
+    head = struct.unpack_from("<I", cq, cq_off[0])[0]
+    tail = struct.unpack_from("<I", cq, cq_off[1])[0]
+    events = []
+    while head != tail:
+        slot = head & ring["cq_mask"]
+        index, result, _ = IO_URING_CQE.unpack_from(
+            cq, cq_off[5] + slot * IO_URING_CQE.size
+        )
+        events.append((index, result))
+        head = (head + 1) & 0xFFFFFFFF
+    struct.pack_into("<I", cq, cq_off[0], head)
+    return events
+
+
+# Tear down an io_uring and release its buffers
+def uring_close(ring):
+    for mapping in ring["maps"]:
+        mapping.close()
+    os.close(ring["fd"])
+    ring.pop("exports", None)
+
+
+# Set up a Linux native AIO context for the buffers
+def aio_open(depth, buffers):
+    if sys.byteorder != "little" or platform.machine() not in AIO_SYSCALLS:
+        raise OSError(errno.ENOSYS, "Linux AIO is not supported on this platform")
+    setup, destroy, submit, getevents = AIO_SYSCALLS[platform.machine()]
+    context = ctypes.c_ulong(0)
+    raw_syscall(setup, depth, ctypes.addressof(context))
+    ring = {
+        "context": context.value,
+        "syscalls": (destroy, submit, getevents),
+        "iocbs": ctypes.create_string_buffer(depth * AIO_IOCB.size),
+        "events": ctypes.create_string_buffer(depth * AIO_EVENT.size),
+        "depth": depth,
+        "queued": [],
+    }
+    ring["exports"], ring["addresses"] = export_buffers(buffers)
+    return ring
+
+
+# Queue a write from buffer `index`; it is submitted by the next reap
+def aio_submit(ring, index, fd, offset, length):
+    AIO_IOCB.pack_into(
+        ring["iocbs"],
+        index * AIO_IOCB.size,
+        index,
+        0,
+        0,
+        IOCB_CMD_PWRITE,
+        0,
+        fd,
+        ring["addresses"][index],
+        length,
+        offset,
+        0,
+        0,
+        0,
+    )
+    ring["queued"].append(index)
+
+
+# Submit queued writes, wait for at least `wait` completions and return
+# them as (index, result) pairs
+def aio_reap(ring, wait):
+    destroy, submit, getevents = ring["syscalls"]
+    if ring["queued"]:
+        base = ctypes.addressof(ring["iocbs"])
+        pointers = (ctypes.c_void_p * len(ring["queued"]))(
+            *(base + index * AIO_IOCB.size for index in ring["queued"])
+        )
+        submitted = raw_syscall(
+            submit, ring["context"], len(pointers), ctypes.addressof(pointers)
+        )
+        del ring["queued"][:submitted]
+    count = raw_syscall(
+        getevents,
+        ring["context"],
+        wait,
+        ring["depth"],
+        ctypes.addressof(ring["events"]),
+        0,
+    )
+    return [
+        AIO_EVENT.unpack_from(ring["events"], i * AIO_EVENT.size)[::2]
+        for i in range(count)
+    ]
+
+
+# Destroy an AIO context, waiting for outstanding writes
+def aio_close(ring):
+    raw_syscall(ring["syscalls"][0], ring["context"])
+    ring.pop("exports", None)
+
+
+ASYNC_BACKENDS = (
+    ("io_uring", uring_open, uring_submit, uring_reap, uring_close),
+    ("aio", aio_open, aio_submit, aio_reap, aio_close),
+)
+
+
+# Open the first async backend the kernel allows, or return None
+def open_async_backend(depth, buffers):
+    if not sys.platform.startswith("linux"):
+        return None
+    for name, open_ring, submit, reap, close_ring in ASYNC_BACKENDS:
+        try:
+            return name, open_ring(depth, buffers), submit, reap, close_ring
+        except OSError:
+            continue
+    return None
+
+
+# Write one region keeping up to queue_depth writes in flight; progress is
+# kept in region["offset"] as the lowest offset not yet confirmed written
+def write_region_async(source_info, region, workers=None):
+    device = source_info["device"]
+    depth = source_info.get("queue_depth") or DEFAULT_QUEUE_DEPTH
+    block_size = source_info.get("block_size", NATIVE_BLOCK_SIZE)
+    alignment = source_info.get("alignment", DIRECT_IO_ALIGNMENT)
+    buffers = [mmap.mmap(-1, block_size) for _ in range(depth)]
+    backend = open_async_backend(depth, buffers)
+    if backend is None:
+        for buffer in buffers:
+            buffer.close()
+        print(f"{device}: no io_uring or AIO support, writing synchronously.")
+        return write_region(source_info, region, workers)
+    name, ring, submit, reap, close_ring = backend
+
+    end = region["end"]
+    try:
+        fill, close_source = make_filler(source_info, workers)
+    except OSError as e:
+        close_ring(ring)
+        for buffer in buffers:
+            buffer.close()
+        region["error"] = f"Cannot open source: {e}"
+        return
+    views = [memoryview(buffer) for buffer in buffers]
+    free = list(range(depth))
+    in_flight = {}
+    offset = region["offset"]
+    tail = fd = None
+    try:
+        fd, direct = open_target(device)
+        exhausted = False
+        while True:
+            while free and not exhausted and offset < end:
+                check_interrupted()
+                index = free.pop()
+                wanted = min(len(views[index]), end - offset)
+                n = fill(views[index][:wanted], offset)
+                if n < wanted:
+                    exhausted = True
+                if n == 0:
+                    free.append(index)
+                    break
+                if direct and n % alignment:
+                    # Unaligned tail; written through the cache once the queue drains
+                    tail = (index, n, offset)
+                    exhausted = True
+                    break
+                throttle(device, n)
+                check_interrupted()
+                submit(ring, index, fd, offset, n)
+                in_flight[index] = (offset, n)
+                offset += n
+            if not in_flight:
+                break
+            for index, result in reap(ring, 1):
+                start, n = in_flight.pop(index)
+                free.append(index)
+                if result == -errno.EIO and source_info.get("tolerant"):
+                    # Find the unwritable sectors of this block synchronously
+                    result, full = write_skipping_bad(
+                        fd, views[index][:n], start, alignment, device
+                    )
+                    if full:
+                        result = -errno.ENOSPC
+                if 0 <= result < n:
+                    # Short writes only happen when the device ends early
+                    result = -errno.ENOSPC
+                if result < 0:
+                    region["offset"] = min([start] + [o for o, _ in in_flight.values()])
+                    raise OSError(-result, os.strerror(-result))
+            region["offset"] = min([offset] + [o for o, _ in in_flight.values()])
+        if tail:
+            index, n, start = tail
+            with open(device, "r+b", buffering=0) as cached:
+                written, full = write_all(cached.fileno(), views[index][:n], start)
+            if full:
+                raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+            offset = start + written
+        region["offset"] = offset
+        sync_target(fd)
+        region["durable"] = offset
+        region["done"] = True
+    except OSError as e:
+        region["error"] = f"{e.strerror} at offset {region['offset']} ({name})"
+    finally:
+        # Never free buffers the kernel may still be writing from
+        while in_flight:
+            try:
+                for index, _ in reap(ring, 1):
+                    in_flight.pop(index, None)
+            except OSError:
+                break
+        close_ring(ring)
+        for view in views:
+            view.release()
+        for buffer in buffers:
+            buffer.close()
+        if fd is not None:
+            os.close(fd)
+        close_source()
+
+
+# Region writer function for an in-process engine
+def region_writer(engine):
+    return write_region_async if engine == "async" else write_region
+
+
+# Compare the synchronous engine with the async engine at several queue
+# depths by writing zeros over the start of a loop device or file
+def benchmark_engines(target, total_mb=256):
+    size = min(get_device_size(target), total_mb * 1024 * 1024)
+    size -= size % NATIVE_BLOCK_SIZE
+    if size == 0:
+        print(f"{target} is smaller than one {NATIVE_BLOCK_SIZE} byte block.")
+        return
+    prompt = f"This overwrites the first {size} bytes of {target}. Continue? [y/N]: "
+    if input(prompt).strip().lower() != "y":
+        return
+    print(f"\033[1mEngine benchmark ({size // 2**20} MB per run):\033[0m")
+    runs = [("native", None)] + [("async", depth) for depth in (1, 4, 16, 32)]
+    for engine, depth in runs:
+        source_info = {
+            "device": target,
+            "source": "/dev/zero",
+            "engine": engine,
+            "queue_depth": depth,
+        }
+        region = {"start": 0, "end": size, "offset": 0, "done": False, "error": None}
+        started = time.time()
+        region_writer(engine)(source_info, region)
+        elapsed = time.time() - started
+        label = engine if depth is None else f"{engine} qd={depth}"
+        result = region["error"] or f"{size / elapsed / 1e6:.0f} MB/s"
+        print(f"  {label: <14} {result}")
+
+
+# Identify the drive behind a device by model and serial, or None when sysfs
+# does not report them (loop devices, image files)
+def drive_identity(device, sysfs_root=SYSFS_ROOT):
+    model = read_device_attribute(device, "model", sysfs_root)
+    serial = read_device_attribute(device, "serial", sysfs_root)
+    serial = serial or read_device_attribute(device, "wwid", sysfs_root)
+    if not (model and serial):
+        return None
+    return f"{model}:{serial}"
+
+
+# Load the autotune results cached by earlier runs
+def load_autotune_cache():
+    global autotune_cache
+    if autotune_cache is None:
+        try:
+            with open(AUTOTUNE_CACHE) as f:
+                autotune_cache = json.load(f)
+        except (OSError, ValueError):
+            autotune_cache = {}
+    return autotune_cache
+
+
+# Save autotune results for identical drives in later runs
+def save_autotune_cache():
+    try:
+        os.makedirs(os.path.dirname(AUTOTUNE_CACHE), exist_ok=True)
+        with open(AUTOTUNE_CACHE, "w") as f:
+            json.dump(autotune_cache, f, indent=2, sort_keys=True)
+    except OSError as e:
+        print(f"Could not save the autotune cache: {e}")
+
+
+# Time zero writes over the start of the device with every block size and,
+# for the async engine, queue depth; the pass overwrites that region anyway.
+# Returns (block size, queue depth, MB/s) of the fastest setting.
+def probe_settings(source_info, size):
+    device = source_info["device"]
+    length = min(size, AUTOTUNE_TRIAL_BYTES)
+    # The ladder includes the block size chosen from the topology
+    block_size, alignment = choose_geometry(probe_topology(device))
+    block_sizes = sorted({block_size, *AUTOTUNE_BLOCK_SIZES})
+    depths = AUTOTUNE_QUEUE_DEPTHS if source_info["engine"] == "async" else (None,)
+    best = None
+    for block_size in block_sizes:
+        for depth in depths:
+            # Every queued block has its own buffer; keep low-memory hosts
+            # and parallel fleets out of trouble
+            if block_size * (depth or 1) > AUTOTUNE_MAX_IN_FLIGHT:
+                continue
+            check_interrupted()
+            trial = {
+                "device": device,
+                "source": "/dev/zero",
+                "engine": source_info["engine"],
+                "block_size": block_size,
+                "alignment": alignment,
+                "queue_depth": depth,
+            }
+            region = {
+                "start": 0,
+                "end": length,
+                "offset": 0,
+                "done": False,
+                "error": None,
+            }
+            started = time.time()
+            region_writer(trial["engine"])(trial, region)
+            if region["error"]:
+                continue
+            rate = length / max(time.time() - started, 1e-6) / 1e6
+            if best is None or rate > best[2]:
+                best = (block_size, depth, rate)
+    return best
+
+
+# Lock in the fastest block size and queue depth for an autotuned pass,
+# probing only drives not seen before
+def autotune_pass(source_info, size):
+    device = source_info["device"]
+    identity = drive_identity(device)
+    key = f"{source_info['engine']}:{identity}"
+    with autotune_lock:
+        cached = load_autotune_cache().get(key) if identity else None
+    if cached:
+        block_size, depth, rate = cached
+        print(f"{device}: using the cached autotune result for {identity}.")
+    elif rate_limiting_enabled():
+        # Throttled trials would all measure the limit, and a capped pass
+        # gains nothing from tuning anyway
+        print(f"{device}: bandwidth is limited; skipping autotune.")
+        return
+    else:
+        print(f"Autotuning {device}...")
+        best = probe_settings(source_info, size)
+        if best is None:
+            print(f"{device}: every autotune trial failed; keeping the settings.")
+            return
+        block_size, depth, rate = best
+        if identity:
+            with autotune_lock:
+                load_autotune_cache()[key] = [block_size, depth, rate]
+                save_autotune_cache()
+    source_info["block_size"] = block_size
+    if depth:
+        source_info["queue_depth"] = depth
+    source_info["command"] = build_native_command(source_info)
+    settings = f"bs={format_size(block_size)}" + (f" qd={depth}" if depth else "")
+    print(f"{device}: {settings} ({rate:.0f} MB/s)")
+
+
+# Flush the device and record the region offsets reached before the flush
+# as durable in the journal
+def make_durable(device, regions):
+    offsets = [region["offset"] for region in regions]
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        sync_target(fd)
+    finally:
+        os.close(fd)
+    for region, offset in zip(regions, offsets):
+        region["durable"] = max(region["durable"], offset)
+    record_written(device, regions)
+    save_journal()
+
+
+# Write a pass in-process: each region writer opens the target once and
+# pwrites large aligned chunks at its own offsets. Regions already planned
+# in `regions` (e.g. by an interrupted run) continue from their offsets.
+def write_native(source_info, regions=None):
+    device = source_info["device"]
+    try:
+        size = get_device_size(device)
+    except OSError as e:
+        return False, str(e)
+    regions = [] if regions is None else regions
+    if not regions:
+        clear_extents(device)
+        # Tuning writes over the start, so it only runs before a fresh pass
+        if source_info.get("autotune"):
+            autotune_pass(source_info, size)
+        # Every pass writes exactly the device size, ending cleanly at the last block
+        regions[:] = plan_regions(
+            size,
+            source_info.get("regions", 1),
+            source_info.get("block_size", NATIVE_BLOCK_SIZE),
+        )
+    pending = [region for region in regions if not region["done"]]
+    # Share the random generator workers between the region writers
+    workers = max(1, (random_workers or RANDOM_WORKERS) // max(len(pending), 1))
+    threads = [
+        threading.Thread(
+            target=region_writer(source_info["engine"]),
+            args=(source_info, region, workers),
+        )
+        for region in pending
+    ]
+    started = last_checkpoint = time.time()
+    resumed = sum(region["offset"] - region["start"] for region in regions)
+    for region in pending:
+        region["error"] = None
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(1)
+            written = sum(region["offset"] - region["start"] for region in regions)
+            print_progress(device, written, started, size=size, resumed=resumed)
+            due = time.time() - last_checkpoint >= JOURNAL_INTERVAL
+            if journal is not None and due:
+                try:
+                    make_durable(device, regions)
+                except OSError as e:
+                    print(f"\nCould not checkpoint {device}: {e}")
+                last_checkpoint = time.time()
+    end_progress()
+    record_written(device, regions)
+
+    written = sum(region["offset"] - region["start"] for region in regions)
+    errors = [
+        f"region {number}: {region['error']}"
+        for number, region in enumerate(regions, start=1)
+        if region["error"]
+    ]
+    # The pass only completes when every region is done
+    if errors or not all(region["done"] for region in regions):
+        return False, "; ".join(errors) or "Interrupted"
+    unmark_extent(device, "failed", 0, size)
+    with extent_lock:
+        bad = extent_list(device_extents(device, "skipped"))
+    for start, end in bad:
+        unmark_extent(device, "written", start, end)
+    skipped = sum(end - start for start, end in bad)
+    if bad:
+        print(f"Skipped {skipped} unwritable bytes in {len(bad)} extent(s):")
+        print_extents(bad)
+    print(f"Wrote {written - skipped} bytes to {device}.")
+    return True, None
+
+
+# Compare a byte range of the expected and read-back buffers
+def ranges_equal(expected, view, start, end):
+    # bytearray == memoryview compares with memcmp, not per element
+    if start == 0 and end == len(expected):
+        return expected == view
+    return expected[start:end] == view[start:end]
+
+
+# Bisect a mismatching buffer down to sectors and merge them into extents
+def collect_mismatches(expected, view, start, end, base, extents):
+    if ranges_equal(expected, view, start, end):
+        return
+    if end - start <= VERIFY_SECTOR_SIZE:
+        first, last = base + start, base + end
+        if extents and extents[-1][1] == first:
+            extents[-1][1] = last
+        else:
+            extents.append([first, last])
+        return
+    middle = start + (end - start) // 2
+    middle -= middle % VERIFY_SECTOR_SIZE
+    if middle <= start:
+        middle = start + VERIFY_SECTOR_SIZE
+    collect_mismatches(expected, view, start, middle, base, extents)
+    collect_mismatches(expected, view, middle, end, base, extents)
+
+
+# Print mismatched extents, shortening very long lists
+def print_extents(extents, limit=20):
+    for start, end in extents[:limit]:
+        print(f"  {start}-{end - 1} ({end - start} bytes)")
+    if len(extents) > limit:
+        print(f"  ... and {len(extents) - limit} more extent(s)")
+
+
+# Read the device back with direct I/O and compare it with the expected stream
+def verify_native(device, expected_info):
+    fill, close_source = make_filler(expected_info)
+    try:
+        size = get_device_size(device)
+        fd, direct = open_target(device, os.O_RDONLY)
+    except OSError as e:
+        close_source()
+        return False, str(e)
+
+    # Bad sectors are narrowed down to logical blocks, as tolerant writes do
+    alignment = choose_geometry(probe_topology(device))[1]
+    buffer = mmap.mmap(-1, NATIVE_BLOCK_SIZE)
+    view = memoryview(buffer)
+    expected = bytearray(NATIVE_BLOCK_SIZE)
+    expected_view = memoryview(expected)
+    offset = 0
+    extents = []
+    unreadable = new_extent_set()
+    started = last_report = time.time()
+    print(f"Verifying {device}...")
+    try:
+        while offset < size:
+            check_interrupted()
+            wanted = min(len(view), size - offset)
+            if direct and wanted % alignment:
+                # O_DIRECT cannot read an unaligned tail; finish through the cache
+                os.close(fd)
+                fd, direct = os.open(device, os.O_RDONLY), False
+            throttle(device, wanted)
+            # Sectors that could not be written are often unreadable too
+            n = read_skipping_bad(fd, view[:wanted], offset, alignment, unreadable)
+            if n == 0:
+                break
+            # The expected stream may end before the device (e.g. a file written once)
+            expected_n = fill(expected_view[:n], offset)
+            collect_mismatches(expected, view, 0, expected_n, offset, extents)
+            offset += expected_n
+            if expected_n < n:
+                break
+            if time.time() - last_report >= 1:
+                print_progress(device, offset, started, "verified", size)
+                last_report = time.time()
+        print_progress(device, offset, started, "verified", size)
+        end_progress()
+    except OSError as e:
+        end_progress()
+        return False, f"{e.strerror} at offset {offset}"
+    finally:
+        expected_view.release()
+        view.release()
+        buffer.close()
+        os.close(fd)
+        close_source()
+
+    # Sectors skipped as unwritable never held the expected data; any other
+    # unreadable sector counts as a mismatch
+    mismatches = new_extent_set()
+    for start, end in extents + extent_list(unreadable):
+        extent_add(mismatches, start, end)
+    mark_extent(device, "verified", 0, offset)
+    with extent_lock:
+        for start, end in extent_list(device_extents(device, "skipped")):
+            extent_remove(mismatches, start, end)
+            unmark_extent(device, "verified", start, end)
+    extents = extent_list(mismatches)
+    for start, end in extents:
+        unmark_extent(device, "verified", start, end)
+        mark_extent(device, "failed", start, end)
+    if extents:
+        mismatched = sum(end - start for start, end in extents)
+        print(f"Mismatched extents on {device}:")
+        print_extents(extents)
+        # The bytes on the device will not change by reading them again
+        return None, (
+            f"Verification failed: {mismatched} bytes in {len(extents)} extent(s) "
+            f"differ"
+        )
+    print(f"Verified {offset} bytes on {device}.")
+    return True, None
+
+
+# Describe what a verify pass expects to read back
+def describe_expectation(expect):
+    if expect == "previous":
+        return "previous"
+    if "pattern" in expect:
+        return f"pattern:{expect['pattern']}"
+    if expect["source"] == KEYSTREAM:
+        return f"seed:{expect['seed']}"
+    if expect["source"] == "/dev/zero":
+        return "zeros"
+    return f"path:{expect['source']}"
+
+
+# Build a schema entry that reads the device back and compares it
+def make_verify_entry(device, expect="previous"):
+    return {
+        "device": device,
+        "type": "verify",
+        "flags": None,
+        "command": f"verify if={device} expect={describe_expectation(expect)}",
+        "engine": "native",
+        "source": None,
+        "continuous_write": False,
+        "expect": expect,
+    }
+
+
+# Work out the expected content of a verify pass; returns (info, error)
+def resolve_expectation(source_info):
+    expect = source_info.get("expect", "previous")
+    if expect != "previous":
+        return expect, None
+    return previous_pass(schema_sources, source_info)
+
+
+# Find the reproducible pass a "previous" verify pass in `sources` checks;
+# returns (info, error)
+def previous_pass(sources, source_info):
+    position = next(i for i, s in enumerate(sources) if s is source_info)
+    previous = next(
+        (
+            s
+            for s in reversed(sources[:position])
+            if s["device"] == source_info["device"] and s["type"] != "verify"
+        ),
+        None,
+    )
+    if previous is None:
+        return None, "No earlier pass on this device to verify"
+    if previous["source"] in (None, "/dev/urandom") or (
+        previous["source"] == KEYSTREAM and not previous.get("seed")
+    ):
+        return None, "The previous pass is not reproducible (use a seeded source)"
+    return previous, None
+
+
+# Check that a verify pass appended to `sources` can work out what to expect;
+# returns the problem, or None
+def expectation_error(sources, entry):
+    if entry.get("expect", "previous") != "previous":
+        return None
+    return previous_pass(sources + [entry], entry)[1]
+
+
+# Run a verify pass against its expected content; a missing expectation is
+# not something a retry can fix
+def verify_pass(source_info):
+    expected_info, error = resolve_expectation(source_info)
+    if error:
+        return None, error
+    return verify_native(source_info["device"], expected_info)
+
+
+# Call fallocate(2) with a mode, which os.posix_fallocate cannot pass
+def fallocate(fd, mode, offset, length):
+    if load_libc().fallocate(fd, mode, offset, length) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+# Zero a range of a block device, or of a file, without sending any data
+def zero_range(fd, block_device, offset, length):
+    if block_device:
+        fcntl.ioctl(fd, BLKZEROOUT, struct.pack("QQ", offset, length))
+        return
+    try:
+        fallocate(fd, FALLOC_FL_ZERO_RANGE, offset, length)
+    except OSError as e:
+        if e.errno != errno.EOPNOTSUPP:
+            raise
+        # Filesystems without ZERO_RANGE can still punch holes, which read as zeros
+        fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length)
+
+
+# Discard a range of a block device, or punch it out of a file
+def discard_range(fd, block_device, offset, length):
+    if block_device:
+        fcntl.ioctl(fd, BLKDISCARD, struct.pack("QQ", offset, length))
+    else:
+        fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length)
+
+
+# Kernel operations by name: (range function, progress verb)
+OFFLOAD_OPERATIONS = {
+    "zeroout": (zero_range, "zeroed"),
+    "discard": (discard_range, "discarded"),
 }
 
 
-# Check if the given path is a block device
-def is_block_device(path):
-    return os.path.exists(path) and stat.S_ISBLK(os.stat(path).st_mode)
+# Sysfs directories of a block device and of its parent disk; partitions
+# share their disk's queue and drive attributes
+def sysfs_block_dirs(device, sysfs_root=SYSFS_ROOT):
+    if os.path.isfile(device):
+        return []
+    name = os.path.basename(os.path.realpath(device))
+    block_dir = os.path.realpath(os.path.join(sysfs_root, "class", "block", name))
+    return [block_dir, os.path.dirname(block_dir)]
 
 
-# Construct the dd command, with or without while loop
-def build_dd_command(if_device, of_device, flags, continuous_write):
-    if continuous_write:
-        return f"while :; do cat {if_device}; done | dd of={of_device} {flags}"
-    return f"dd if={if_device} of={of_device} {flags}"
+# Locate the sysfs queue directory of a block device
+def sysfs_queue_dir(device, sysfs_root=SYSFS_ROOT):
+    for block_dir in sysfs_block_dirs(device, sysfs_root):
+        queue_dir = os.path.join(block_dir, "queue")
+        if os.path.isdir(queue_dir):
+            return queue_dir
+    return None
 
 
-def create_data_file():
-    print("\n\033[1mCreate Custom Data File:\033[0m")
+# Read a drive attribute such as model or serial, or None if it is unavailable
+def read_device_attribute(device, name, sysfs_root=SYSFS_ROOT):
+    for block_dir in sysfs_block_dirs(device, sysfs_root):
+        try:
+            with open(os.path.join(block_dir, "device", name)) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value:
+            return value
+    return None
 
-    # Get content
-    user_input = input("Enter file content (default: All binary ones): ").strip()
-    content = (
-        b"\xFF" if not user_input or user_input.upper() == "FF" else user_input.encode()
-    )
 
-    # Get file size
-    size_mb = input("Enter file size in MB (default: 128MB): ").strip()
+# Read an integer queue attribute from sysfs, or None if it is unavailable
+def read_queue_attribute(device, name, sysfs_root=SYSFS_ROOT):
+    queue_dir = sysfs_queue_dir(device, sysfs_root)
+    if queue_dir is None:
+        return None
     try:
-        size_mb = int(size_mb) if size_mb else 128
-    except ValueError:
-        print("Invalid size input. Using default 128MB.")
-        size_mb = 128
+        with open(os.path.join(queue_dir, name)) as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
 
-    # Get filename (with default)
-    default_name = f"gen_{int(time.time())}.tmp"
-    filename = (
-        input(f"Enter filename (default: {default_name}): ").strip() or default_name
-    )
 
-    # Get cleanup preference
-    cleanup = (
-        input("Remove file after script completion? [Y/n]: ").strip().lower() != "n"
+# Read a block device's queue topology from sysfs, or None for image files
+# and devices sysfs does not know
+def probe_topology(device, sysfs_root=SYSFS_ROOT):
+    if sysfs_queue_dir(device, sysfs_root) is None:
+        return None
+    return {
+        name: read_queue_attribute(device, name, sysfs_root)
+        for name in TOPOLOGY_ATTRIBUTES
+    }
+
+
+# Pick (block size, O_DIRECT alignment) for a device: whole physical blocks,
+# or optimal I/O units when the device reports them, split evenly into the
+# largest requests the queue accepts and no larger than the default block
+def choose_geometry(topology):
+    if not topology:
+        return NATIVE_BLOCK_SIZE, DIRECT_IO_ALIGNMENT
+    logical = topology["logical_block_size"] or VERIFY_SECTOR_SIZE
+    unit = max(topology["physical_block_size"] or logical, logical)
+    optimal = topology["optimal_io_size"]
+    if optimal and optimal % unit == 0 and optimal <= NATIVE_BLOCK_SIZE:
+        unit = optimal
+    block_size = max(NATIVE_BLOCK_SIZE - NATIVE_BLOCK_SIZE % unit, unit)
+    max_request = (topology["max_sectors_kb"] or 0) * 1024
+    if max_request and max_request % unit == 0 and block_size > max_request:
+        block_size -= block_size % max_request
+    return block_size, logical
+
+
+# Format a byte count as a dd size operand
+def format_size(size):
+    for suffix, unit in (("G", 1024**3), ("M", 1024**2), ("K", 1024)):
+        if size % unit == 0:
+            return f"{size // unit}{suffix}"
+    return str(size)
+
+
+# Describe the probed topology of a device and the geometry chosen for it
+def describe_geometry(device):
+    topology = probe_topology(device)
+    block_size, alignment = choose_geometry(topology)
+    chosen = f"bs={format_size(block_size)} align={alignment}"
+    if not topology:
+        return f"no block topology -> {chosen}"
+    rotational = "rotational" if topology["rotational"] else "non-rotational"
+    return (
+        f"logical {topology['logical_block_size']}, "
+        f"physical {topology['physical_block_size']}, "
+        f"optimal {topology['optimal_io_size']}, "
+        f"max request {topology['max_sectors_kb']}K, {rotational} -> {chosen}"
     )
 
-    # Create the file
-    repeat_count = (size_mb * 1024 * 1024) // len(content)
-    with open(filename, "wb") as f:
-        f.write(content * repeat_count)
 
-    if cleanup:
-        temp_files.append(filename)
+# Check that a pass can be offloaded to the kernel on this system and
+# device; returns the problem, or None
+def offload_error(device, source_type):
+    operation = source_types_metadata[source_type]["offload"]
+    if not sys.platform.startswith("linux"):
+        return f"The {operation} pass needs Linux"
+    if (
+        operation == "discard"
+        and is_block_device(device)
+        and not read_queue_attribute(device, "discard_max_bytes")
+    ):
+        return f"{device} does not support discard"
+    return None
 
-    print(f"\nCreated file: {filename}")
-    print(f"Size: {size_mb}MB")
-    print(f"Cleanup on exit: {'Yes' if cleanup else 'No'}")
 
-    # Offer to add to schema with automatic path selection
-    if input("\nAdd this file to schema? [Y/n]: ").strip().lower() != "n":
-        device = get_device()
-        if device:
-            write_mode = (
-                input("Write source: (o)nce or (c)ontinuously? ").strip().lower()
-            )
-            continuous_write = write_mode.startswith("c")
+# Build a schema entry for a pass offloaded to the kernel
+def make_offload_entry(device, source_type, sample=0):
+    metadata = source_types_metadata[source_type]
+    chunk_mb = OFFLOAD_CHUNK_SIZE // (1024 * 1024)
+    command = f"{metadata['offload']} of={device} range={chunk_mb}M"
+    entry = {
+        "device": device,
+        "type": source_type,
+        "flags": None,
+        "command": command + (f" sample={sample}" if sample else ""),
+        "engine": "kernel",
+        "source": metadata["if_device"],
+        "continuous_write": False,
+    }
+    if sample:
+        entry["sample"] = sample
+    return entry
 
-            flags = (
-                input(
-                    f"Enter dd flags or press Enter for default [{DEFAULT_DD_FLAGS}]: "
-                ).strip()
-                or DEFAULT_DD_FLAGS
-            )
 
-            command = build_dd_command(filename, device, flags, continuous_write)
+# Read random blocks back and count how many are all zeros
+def sample_zeros(device, size, count):
+    fd, direct = open_target(device, os.O_RDONLY)
+    buffer = mmap.mmap(-1, SAMPLE_BLOCK_SIZE)
+    zeros = bytearray(SAMPLE_BLOCK_SIZE)
+    blocks = size // SAMPLE_BLOCK_SIZE
+    zero_blocks = 0
+    try:
+        for _ in range(count):
+            offset = random.randrange(blocks) * SAMPLE_BLOCK_SIZE
+            n = read_into(fd, memoryview(buffer), offset)
+            if zeros[:n] == buffer[:n]:
+                zero_blocks += 1
+    finally:
+        buffer.close()
+        os.close(fd)
+    return zero_blocks
 
-            schema_sources.append(
-                {"device": device, "type": "path", "flags": flags, "command": command}
-            )
-            print("Source added successfully.")
 
+# Ask the kernel to zero or discard the whole device in large ranges;
+# devices with WRITE ZEROES / WRITE SAME / TRIM do the work themselves
+def offload_native(source_info, regions=None):
+    device = source_info["device"]
+    operation = source_types_metadata[source_info["type"]]["offload"]
+    apply_range, verb = OFFLOAD_OPERATIONS[operation]
+    error = offload_error(device, source_info["type"])
+    if error:
+        # Configuration problems do not go away on a retry
+        return None, error
+    try:
+        size = get_device_size(device)
+        fd = os.open(device, os.O_WRONLY)
+    except OSError as e:
+        return False, str(e)
+    block_device = stat.S_ISBLK(os.fstat(fd).st_mode)
+
+    chunk = OFFLOAD_CHUNK_SIZE
+    if operation == "discard" and block_device:
+        # Keep every range on a discard granularity boundary
+        granularity = read_queue_attribute(device, "discard_granularity") or 1
+        chunk -= chunk % granularity
 
-def execute_command(command):
+    regions = [] if regions is None else regions
+    if not regions:
+        clear_extents(device)
+        regions.extend(plan_regions(size, 1, chunk))
+    region = regions[0]
+    offset = resumed = region["offset"]
+    started = last_report = last_checkpoint = time.time()
     try:
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            universal_newlines=True,
+        while offset < size:
+            check_interrupted()
+            length = min(chunk - offset % chunk, size - offset)
+            apply_range(fd, block_device, offset, length)
+            offset += length
+            region["offset"] = offset
+            if time.time() - last_report >= 1:
+                print_progress(device, offset, started, verb, size, resumed)
+                last_report = time.time()
+            due = time.time() - last_checkpoint >= JOURNAL_INTERVAL
+            if journal is not None and due:
+                make_durable(device, regions)
+                last_checkpoint = time.time()
+        sync_target(fd)
+        region["durable"] = offset
+        region["done"] = True
+        record_written(device, regions)
+        print_progress(device, offset, started, verb, size, resumed)
+        end_progress()
+    except OSError as e:
+        end_progress()
+        region["error"] = f"{e.strerror} at offset {offset}"
+        return False, region["error"]
+    finally:
+        os.close(fd)
+    print(f"{verb.capitalize()} {offset} bytes on {device}.")
+
+    count = source_info.get("sample", 0)
+    if count and size >= SAMPLE_BLOCK_SIZE:
+        try:
+            zero_blocks = sample_zeros(device, size, count)
+        except OSError as e:
+            return False, f"Sampling failed: {e.strerror}"
+        print(f"{zero_blocks} of {count} sampled blocks read back as zeros.")
+        # Punched holes always read as zeros; devices only promise it when
+        # they advertise discard_zeroes_data
+        promised = not block_device or read_queue_attribute(
+            device, "discard_zeroes_data"
         )
-        stderr_output = ""
-        while True:
-            output = process.stderr.readline()
-            if output == "" and process.poll() is not None:
-                break
-            if output:
-                print(output.strip(), end="\r")
-                stderr_output += output
+        if zero_blocks < count:
+            if promised:
+                # The regions are done; discarding them again changes nothing
+                return None, "Discarded blocks did not read back as zeros"
+            print("The device does not promise zeros after discard.")
+    return True, None
+
+
+# Rebuild a dd pass's command to continue at `offset`, reading stdin when
+# `fed` by the in-process repeater; None if the user's own flags already
+# position or bound it
+def resume_dd_command(source_info, offset, size, fed=False):
+    flags = source_info["flags"] or ""
+    if re.search(r"\b(count|seek|skip|oseek|iseek)=", flags):
+        return None
+    if offset:
+        flags += f" seek={offset} oflag=seek_bytes"
+    source = source_info["source"]
+    fed = fed or source_info["continuous_write"]
+    if offset and not fed:
+        mode = os.stat(source).st_mode
+        # Streams such as /dev/urandom have no position to skip to
+        if stat.S_ISREG(mode) or stat.S_ISBLK(mode):
+            flags += f" skip={offset} iflag=skip_bytes"
+    return build_dd_command(source, source_info["device"], flags, fed, size - offset)
+
+
+# Run a dd pass; the region is checkpointed while dd runs and records how
+# far dd got after a failure, so a retry or --resume continues from there.
+# While bandwidth limits apply, dd reads its input from the throttled
+# in-process repeater.
+def write_dd(source_info, regions=None):
+    device = source_info["device"]
+    throttled = rate_limiting_enabled() and not source_info["continuous_write"]
+    feed = source_info if source_info["continuous_write"] else None
+    try:
+        size = get_device_size(device)
+    except OSError:
+        size = None
+    if regions is None or not size:
+        return execute_command(source_info["command"], device, feed)
+    if not regions:
+        clear_extents(device)
+        regions.extend(plan_regions(size, 1))
+    region = regions[0]
+    region["error"] = None
+    offset = region["offset"]
+    command = source_info["command"]
+    if offset or throttled:
+        rebuilt = resume_dd_command(source_info, offset, size, throttled)
+        if rebuilt is None:
+            offset = 0
+            if throttled:
+                print("The dd flags position this pass; it is not rate limited.")
+        else:
+            command = rebuilt
+            feed = source_info if throttled else feed
+            if offset:
+                print(f"Continuing at offset {offset}: {command}")
+    # Checkpoints round down to whole blocks, like the failure path below
+    def checkpoint(reached):
+        region["offset"] = max(offset, reached - reached % DIRECT_IO_ALIGNMENT)
+        try:
+            make_durable(device, regions)
+        except OSError as e:
+            print(f"\nCould not checkpoint {device}: {e}")
+
+    progress = {}
+    success, error = execute_command(
+        command,
+        device,
+        feed,
+        progress,
+        offset,
+        checkpoint if journal is not None else None,
+    )
+    if success:
+        region["offset"] = region["durable"] = size
+        region["done"] = True
+        record_written(device, regions)
+        unmark_extent(device, "failed", 0, size)
+        return True, None
+    # Rewrite the last partial block rather than guess how much of it landed
+    reached = progress.get("bytes", offset)
+    region["offset"] = max(offset, reached - reached % DIRECT_IO_ALIGNMENT)
+    region["error"] = error
+    return False, error
+
+
+# Run a single pass with the engine selected for it; dd, in-process and
+# kernel passes keep their progress in `regions` so they can continue later.
+# Returns (success, error), where success is None for failures that a retry
+# cannot fix.
+def execute_pass(source_info, regions=None):
+    if source_info["type"] == "verify":
+        return verify_pass(source_info)
+    if source_info.get("engine") == "kernel":
+        return offload_native(source_info, regions)
+    if source_info.get("engine") in IN_PROCESS_ENGINES:
+        return write_native(source_info, regions)
+    return write_dd(source_info, regions)
+
 
-        print()
-        if process.returncode == 0:
-            return True, None
-        elif "No space left on device" in stderr_output:
-            print("Drive full - pass completed successfully!")
-            return True, None
-        return False, "Command failed"
-    except Exception as e:
-        return False, str(e)
-        
-        
 # Check of_device
 def get_device():
     device = input("Enter target drive (e.g., /dev/sdb): ").strip()
-    if not is_block_device(device):
-        print("Invalid device path. Ensure it is a valid block device in /dev/.")
+    if not (is_block_device(device) or is_image_file(device)):
+        print(
+            "Invalid device path. Ensure it is a valid block device in /dev/ "
+            "or an existing image file."
+        )
         return None
     return device
 
 
+# Ask for a repeating pattern in hex; returns normalised hex or None
+def get_pattern():
+    pattern = input("Enter pattern in hex (default: FF): ").strip() or "FF"
+    try:
+        if bytes.fromhex(pattern):
+            return bytes.fromhex(pattern).hex()
+    except ValueError:
+        pass
+    print("Invalid pattern.")
+    return None
+
+
+# Ask what a verify pass should expect to read back
+def get_expectation():
+    print("\n\033[1mExpected content:\033[0m")
+    print("(p)revious - the preceding pass on this device (default)")
+    print("(z)eros    - all zero bytes")
+    print("(r)epeat   - a repeating hex pattern")
+    print("(f)ile     - a file tiled across the device")
+    print("(s)eed     - a fast random stream with a known seed")
+    choice = input("Choose expectation: ").strip().lower()
+
+    if choice == "z":
+        return {"source": "/dev/zero"}
+    if choice == "r":
+        pattern = get_pattern()
+        if pattern:
+            return {"source": None, "pattern": pattern}
+        print("Expecting the previous pass instead.")
+    elif choice == "f":
+        path = input("Enter the full path to the file: ").strip()
+        if os.path.isfile(path) and os.path.getsize(path):
+            return {"source": path, "continuous_write": True}
+        print("Invalid path. Expecting the previous pass instead.")
+    elif choice == "s":
+        return {"source": KEYSTREAM, "seed": get_seed()}
+    return "previous"
+
+
 def add_source_to_schema():
     device = get_device()
     if not device:
@@ -155,19 +2614,46 @@ def add_source_to_schema():
     # Prompt for source type
     print("\n\033[1mChoose source type:\033[0m")
     for key, meta in source_types_metadata.items():
-        print(f"({key[0]}){key[1:]: <6} - {meta['description']}")
+        shortcut = meta.get("shortcut", key[0])
+        label = key.replace(shortcut, f"({shortcut})", 1)
+        print(f"{label: <9} - {meta['description']}")
 
     source_type_key = input("Choose source type: ").strip().lower()
 
     # Retrieve metadata for the selected source type
     source_type = next(
-        (key for key in source_types_metadata if source_type_key == key[0]), None
+        (
+            key
+            for key, meta in source_types_metadata.items()
+            if source_type_key in (key, meta.get("shortcut", key[0]))
+        ),
+        None,
     )
     if not source_type:
         print("Invalid source type.")
         return
     metadata = source_types_metadata[source_type]
 
+    if metadata.get("verify"):
+        entry = make_verify_entry(device, get_expectation())
+        error = expectation_error(schema_sources, entry)
+        if error:
+            print(f"{error}; verify pass not added.")
+            return
+        schema_sources.append(entry)
+        print("Verify pass added successfully.")
+        return
+
+    if metadata.get("offload"):
+        error = offload_error(device, source_type)
+        if error:
+            print(f"{error}; pass not added.")
+            return
+        sample = get_sample_count() if metadata["offload"] == "discard" else 0
+        schema_sources.append(make_offload_entry(device, source_type, sample))
+        print("Source added successfully.")
+        return
+
     # Configure if_device based on source type
     if_device = metadata.get("if_device")
 
@@ -181,25 +2667,52 @@ def add_source_to_schema():
         write_mode = input("Write source: (o)nce or (c)ontinuously? ").strip().lower()
         metadata["continuous_write"] = write_mode.startswith("c")
 
-    # Get dd flags
-    flags = (
-        input(
-            f"Enter dd flags or press Enter for default [{DEFAULT_DD_FLAGS}]: "
-        ).strip()
-        or DEFAULT_DD_FLAGS
-    )
+    # Get the engine and, for dd, its flags
+    engine = get_engine()
+    if metadata.get("native_only") and engine not in IN_PROCESS_ENGINES:
+        print("This source is generated in-process; using the native engine.")
+        engine = "native"
+    flags = get_flags(engine, device)
+    regions = get_regions(engine, device)
+    queue_depth = get_queue_depth(engine)
+    autotune = get_autotune(engine)
+    tolerant = get_tolerant(engine)
 
-    # Build the command using the simplified build_dd_command
-    command = build_dd_command(
-        if_device, device, flags, metadata.get("continuous_write", False)
-    )
+    # Seeded sources record their seed so the pass can be regenerated later
+    seed = get_seed() if metadata.get("seeded") else None
+
+    # Patterns are tiled in memory and never touch the disk
+    pattern = None
+    if metadata.get("requires_pattern"):
+        pattern = get_pattern()
+        if not pattern:
+            return
+        if_device = f"pattern:{pattern}"
 
     # Add the source to schema
-    schema_sources.append(
-        {"device": device, "type": source_type, "flags": flags, "command": command}
+    entry = make_schema_entry(
+        device,
+        source_type,
+        if_device,
+        metadata.get("continuous_write", False),
+        engine,
+        flags,
+        seed,
+        regions,
+        queue_depth,
+        pattern,
+        autotune,
+        tolerant,
     )
+    schema_sources.append(entry)
     print("Source added successfully.")
 
+    if seed and (
+        input("Add a pass verifying it by read-back? [y/N]: ").strip().lower() == "y"
+    ):
+        schema_sources.append(make_verify_entry(device))
+        print("Verify pass added successfully.")
+
 
 # Menu item: delete a pass from the schema
 def delete_source():
@@ -225,7 +2738,12 @@ def copy_source():
     try:
         source_number = int(input("Enter source number to copy: ").strip()) - 1
         if 0 <= source_number < len(schema_sources):
-            schema_sources.append(schema_sources[source_number].copy())
+            copied = schema_sources[source_number].copy()
+            if copied.get("seed"):
+                # Every pass gets its own seed
+                copied["seed"] = new_seed()
+                copied["command"] = build_native_command(copied)
+            schema_sources.append(copied)
             print("Source copied.")
         else:
             print("Invalid source number.")
@@ -242,13 +2760,20 @@ def print_schema():
     print(
         f"Max retries: {max_retries_setting if max_retries_setting > 0 else 'infinite'}"
     )
+    print(
+        f"Parallel devices: {max_parallel_jobs if max_parallel_jobs > 0 else 'all'}"
+    )
+    print(f"Bandwidth: {describe_rate_limits()}")
     print()
     if not schema_sources:
         print("  (No sources added yet)")
     else:
         for i, s in enumerate(schema_sources, start=1):
-            print(f"\033[1m{i}.\033[0m {s['command']}")
+            print(f"\033[1m{i}.\033[0m {describe_pass(s)}")
             print()
+        print("\033[1mDevice geometry:\033[0m")
+        for device in dict.fromkeys(s["device"] for s in schema_sources):
+            print(f"  {device}: {describe_geometry(device)}")
 
 
 # Menu item: set the run count
@@ -282,42 +2807,374 @@ def set_max_retries():
         return 0
 
 
-def run_schema():
-    run_count = 0
+# Menu item: limit how many devices are worked on at the same time
+def set_parallel_jobs():
+    global max_parallel_jobs
+    try:
+        jobs = int(
+            input("Enter maximum devices to run in parallel (0 for all): ").strip()
+        )
+        if jobs < 0:
+            print("Invalid input. Running all devices in parallel.")
+            jobs = 0
+        max_parallel_jobs = jobs
+    except ValueError:
+        print("Invalid input. Running all devices in parallel.")
+        max_parallel_jobs = 0
+
+
+# Menu item: limit bandwidth across all devices and for each device
+def set_bandwidth():
+    for target, scope in (("global", "all devices together"), ("jobs", "each device")):
+        value = input(f"Enter bandwidth limit for {scope}, e.g. 200M (0 for none): ")
+        rate = parse_rate(value.strip() or "0")
+        if rate is None:
+            print("Invalid input. Leaving it unlimited.")
+            rate = 0
+        set_rate_limit(target, rate)
+    print(f"Limits can be changed during the run by editing {rate_control_path}.")
+
+
+# Write the journal atomically and make it durable
+def save_journal():
+    if journal is None or not journal_saving:
+        return
+    with journal_lock:
+        state = dict(journal)
+        state["passes"] = {
+            number: [[r["start"], r["end"], r["durable"]] for r in regions]
+            for number, regions in journal["passes"].items()
+        }
+        with extent_lock:
+            maps = {
+                device: {state: encode_extents(e) for state, e in states.items()}
+                for device, states in extent_maps.items()
+            }
+        write_durably(f"{journal_path}.extents", maps)
+        write_durably(journal_path, state)
+
+
+# Save the journal; if it cannot be written, warn and carry on without
+# checkpoints
+def try_save_journal():
+    global journal_saving
+    try:
+        save_journal()
+    except OSError as e:
+        journal_saving = False
+        print(f"Could not write journal {journal_path}: {e}")
+        print("Continuing without checkpoints; this run cannot be resumed.")
+
+
+# Write JSON to a file atomically and make it durable
+def write_durably(path, data):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+# Start journaling a schema run from scratch
+def start_journal():
+    global journal
+    journal = {
+        "schema": schema_sources,
+        "repeat_count": schema_repeat_count,
+        "max_retries": max_retries_setting,
+        "parallel_jobs": max_parallel_jobs,
+        "rate_limits": rate_limits,
+        "run": 0,
+        "completed": [],
+        "passes": {},
+    }
+
+
+# Load an interrupted run's journal and restore its schema and settings
+def load_journal():
+    global journal, schema_repeat_count, max_retries_setting, max_parallel_jobs
+    with open(journal_path) as f:
+        state = json.load(f)
+    schema_sources[:] = state["schema"]
+    schema_repeat_count = state["repeat_count"]
+    max_retries_setting = state["max_retries"]
+    max_parallel_jobs = state["parallel_jobs"]
+    for target, rate in state.get("rate_limits", {}).items():
+        set_rate_limit(target, rate)
+    try:
+        with open(f"{journal_path}.extents") as f:
+            maps = json.load(f)
+    except OSError:
+        maps = {}
+    extent_maps.clear()
+    for device, states in maps.items():
+        extent_maps[device] = {
+            state: decode_extents(encoded) for state, encoded in states.items()
+        }
+    # Interrupted passes continue where the written extent covering their
+    # start ends, as recorded at the last checkpoint
+    def resumed_region(number, start, end, durable):
+        device = schema_sources[int(number) - 1]["device"]
+        with extent_lock:
+            reach = extent_reach(device_extents(device, "written"), start)
+        offset = min(max(reach, durable), end)
+        return {
+            "start": start,
+            "end": end,
+            "offset": offset,
+            "durable": offset,
+            "done": offset >= end,
+            "error": None,
+            "retries": 0,
+            "stalls": 0,
+        }
+
+    state["passes"] = {
+        number: [resumed_region(number, *region) for region in regions]
+        for number, regions in state["passes"].items()
+    }
+    state["schema"] = schema_sources
+    journal = state
+
+
+# Record the start of a schema run; a resumed run keeps its progress
+def begin_journal_run(run_count):
+    if journal["run"] != run_count:
+        with journal_lock:
+            journal["run"] = run_count
+            journal["completed"] = []
+            journal["passes"] = {}
+            # Seeds this run writes with, for verifying the device later
+            journal["seeds"] = {
+                str(number): run_seed(source_info["seed"], run_count)
+                for number, source_info in enumerate(schema_sources, start=1)
+                if source_info.get("seed")
+            }
+        if run_count > 1:
+            for number, seed in journal["seeds"].items():
+                print(f"Pass {number} writes with seed {seed} in this run.")
+    try_save_journal()
+
+
+# The live progress regions of a pass, shared with the journal
+def journal_regions(number):
+    if journal is None:
+        return []
+    with journal_lock:
+        return journal["passes"].setdefault(str(number), [])
+
+
+# Record a completed pass
+def complete_journal_pass(number):
+    if journal is None:
+        return
+    with journal_lock:
+        journal["completed"].append(number)
+        journal["passes"].pop(str(number), None)
+    try_save_journal()
+
+
+# Remove the journal and extent map once the schema has completed
+def finish_journal():
+    global journal
+    journal = None
+    for path in (journal_path, f"{journal_path}.extents"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# Group passes by device, keeping their schema order within each device
+def plan_device_jobs(sources):
+    jobs = {}
+    for number, source_info in enumerate(sources, start=1):
+        jobs.setdefault(source_info["device"], []).append((number, source_info))
+    return jobs
+
+
+# Count a failure against every failed region and mark its offset failed in
+# the extent map; regions failing again at an offset already marked back off
+# exponentially. Returns (highest region retry count, seconds to wait).
+def record_region_failures(device, regions):
+    attempts = delay = 0
+    failed = device_extents(device, "failed")
+    for region in regions:
+        if not region["error"]:
+            continue
+        region["retries"] += 1
+        offset = region["offset"]
+        with extent_lock:
+            stalled = extent_reach(failed, offset) > offset
+        if stalled:
+            region["stalls"] += 1
+            backoff = RETRY_BACKOFF * 2 ** (region["stalls"] - 1)
+            delay = max(delay, min(backoff, RETRY_BACKOFF_MAX))
+        else:
+            region["stalls"] = 0
+            mark_extent(device, "failed", offset, offset + VERIFY_SECTOR_SIZE)
+        attempts = max(attempts, region["retries"])
+    return attempts, delay
+
+
+# Run one pass, retrying failures up to max_retries_setting times
+def run_pass_with_retries(number, source_info):
+    # Messages from parallel jobs are interleaved, so name the device
+    prefix = "" if status_board is None else f"{source_info['device']}: "
+    if journal is not None and number in journal["completed"]:
+        print(f"{prefix}Pass {number} already completed in this run; skipping.")
+        return True
+    regions = journal_regions(number)
+    if regions:
+        resumed = sum(region["durable"] - region["start"] for region in regions)
+        print(f"{prefix}Resuming pass {number} after {resumed} durable bytes.")
+    retry_count = 0
+    while max_retries_setting == 0 or retry_count < max_retries_setting:
+        if stop_event.is_set():
+            return False
+        # Failed regions are retried from the offset they reached; verify
+        # passes have no regions and start from the beginning
+        success, error = execute_pass(source_info, regions)
+        if success and not stop_event.is_set():
+            complete_journal_pass(number)
+            print(f"\n{prefix}Pass {number} completed successfully.")
+            return True
+        if stop_event.is_set():
+            return False
+        if success is None:
+            print(f"\n{prefix}Error: {error}. Pass {number} failed; not retrying.")
+            return False
+        if any(region["error"] for region in regions):
+            # Retries are counted per region, not per pass
+            retry_count, delay = record_region_failures(
+                source_info["device"], regions
+            )
+        else:
+            retry_count, delay = retry_count + 1, 0
+        if max_retries_setting > 0:
+            print(
+                f"\n{prefix}Error: {error}. Retrying... "
+                f"(attempt {retry_count} of {max_retries_setting})"
+            )
+        else:
+            print(f"\n{prefix}Error: {error}. Retrying... (attempt {retry_count})")
+        if delay:
+            print(f"{prefix}Same offset failed again; waiting {delay} s.")
+            stop_event.wait(delay)
+    return False
+
+
+# Run the passes of one device in order; returns whether all of them succeeded
+def run_device_job(device, passes):
+    succeeded = True
+    for number, source_info in passes:
+        if status_board is None:
+            print(f"\n\033[1m{number}.\033[0m {describe_pass(source_info)}\n")
+        else:
+            status_board[device] = [f"pass {number}", "starting"]
+            print(f"{device}: starting pass {number}: {describe_pass(source_info)}")
+        succeeded = run_pass_with_retries(number, source_info) and succeeded
+    if status_board is not None:
+        status_board[device] = ["done", ""]
+    return succeeded
+
+
+# Print one status line per device
+def print_status_board():
+    print(f"\n\033[1mStatus at {time.strftime('%H:%M:%S')}:\033[0m")
+    for device, (label, line) in status_board.items():
+        print(f"  {device: <14} {label: <8} {line}")
+
+
+# Run device jobs concurrently, at most max_parallel_jobs at a time; returns
+# whether every pass succeeded
+def run_devices_parallel(jobs):
+    global status_board, random_workers
+    status_board = {device: ["queued", ""] for device in jobs}
+    done = threading.Event()
+
+    def refresh_status():
+        while not done.wait(STATUS_INTERVAL):
+            print_status_board()
+
+    printer = threading.Thread(target=refresh_status, daemon=True)
+    printer.start()
+    workers = min(max_parallel_jobs or len(jobs), len(jobs))
+    # Devices running at the same time share the keystream workers
+    random_workers = max(1, RANDOM_WORKERS // workers)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(run_device_job, device, passes)
+                for device, passes in jobs.items()
+            ]
+            return all([future.result() for future in futures])
+    finally:
+        done.set()
+        printer.join()
+        print_status_board()
+        status_board = None
+        random_workers = None
+
+
+# Run the schema; a resumed schema continues the journal's interrupted run.
+# Returns whether every pass of every run succeeded.
+def run_schema(resume=False):
+    jobs = plan_device_jobs(schema_sources)
+    if not resume:
+        start_journal()
+    # Bandwidth limits can be changed through the control file during the run
+    done = threading.Event()
+    watcher = threading.Thread(target=watch_rate_control, args=(done,), daemon=True)
+    watcher.start()
+    try:
+        return run_schema_passes(jobs)
+    finally:
+        done.set()
+        watcher.join()
+
+
+# Run every run of the schema; returns whether every pass succeeded
+def run_schema_passes(jobs):
+    succeeded = True
+    run_count = max(journal["run"] - 1, 0)
     while schema_repeat_count == 0 or run_count < schema_repeat_count:
         run_count += 1
         print(f"\n\033[1m --- Starting Schema Run {run_count} ---\033[0m")
+        begin_journal_run(run_count)
 
-        for i, source_info in enumerate(schema_sources, start=1):
-            print(f"\n\033[1m{i}.\033[0m {source_info['command']}\n")
-
-            retry_count = 0
-            while max_retries_setting == 0 or retry_count < max_retries_setting:
-                success, error = execute_command(source_info["command"])
-                if success:
-                    print("\nPass completed successfully.")
-                    break
-                retry_count += 1
-                if max_retries_setting > 0:
-                    print(
-                        f"\nError: {error}. Retrying... (attempt {retry_count} of {max_retries_setting})"
-                    )
-                else:
-                    print(f"\nError: {error}. Retrying... (attempt {retry_count})")
+        if len(jobs) > 1 and max_parallel_jobs != 1:
+            succeeded = run_devices_parallel(jobs) and succeeded
+        else:
+            for i, source_info in enumerate(schema_sources, start=1):
+                print(f"\n\033[1m{i}.\033[0m {describe_pass(source_info)}\n")
+                succeeded = run_pass_with_retries(i, source_info) and succeeded
 
+        if stop_event.is_set():
+            return False
         if schema_repeat_count > 0:
             print(f"--- Completed run {run_count} of {schema_repeat_count} ---")
 
+    print_extent_report()
+    finish_journal()
     print("Disk preparation completed.")
+    return succeeded
 
 
 # Remove temporary files and exit gracefully
 def cleanup(signum, frame):
+    stop_event.set()
     for temp_file in temp_files:
         if os.path.isfile(temp_file):
             os.remove(temp_file)
     print("\nProcess interrupted. Exiting.")
-    sys.exit(0)
+    if journal is not None:
+        print(f"Progress is kept in {journal_path}; continue with --resume.")
+    sys.exit(130)
 
 
 # Register cleanup handler
@@ -326,6 +3183,7 @@ signal.signal(signal.SIGINT, cleanup)
 
 # Main menu for schema setup and execution
 def main_menu():
+    global max_retries_setting
     while True:
         print("\n\033[1mMain Menu:\033[0m")
         print("(a)dd      - Add source to schema")
@@ -334,6 +3192,9 @@ def main_menu():
         print("(g)enerate - Generate a custom data file")
         print("(r)epeat   - Set whether to repeat the schema")
         print("(m)ax      - Set maximum retries")
+        print("(j)obs     - Set how many devices run in parallel")
+        print("(l)imit    - Limit bandwidth globally and per device")
+        print("(s)ave     - Save the schema to a JSON file")
         print("Type 'done' to execute your schema.")
 
         choice = input("Choose an option: ").strip().lower()
@@ -349,7 +3210,13 @@ def main_menu():
         elif choice == "g":
             create_data_file()
         elif choice == "m":
-            set_max_retries()
+            max_retries_setting = set_max_retries()
+        elif choice == "j":
+            set_parallel_jobs()
+        elif choice == "l":
+            set_bandwidth()
+        elif choice == "s":
+            save_schema()
         elif choice == "done":
             run_schema()
             break
@@ -359,8 +3226,556 @@ def main_menu():
         print_schema()
 
 
+# Read a schema file: TOML for .toml files, JSON otherwise
+def read_schema_file(path):
+    if path.endswith(".toml"):
+        if tomllib is None:
+            raise ValueError("TOML schema files need Python 3.11 or later")
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+# Check that an optional schema value is a whole number of at least `minimum`
+def schema_number(item, key, default, minimum=1):
+    value = item.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise ValueError(f"{key} must be a whole number of at least {minimum}")
+    return value
+
+
+# Normalise a schema hex value the way get_pattern does
+def schema_hex(value, key):
+    try:
+        if isinstance(value, str) and bytes.fromhex(value):
+            return bytes.fromhex(value).hex()
+    except ValueError:
+        pass
+    raise ValueError(f"{key} must be non-empty hex")
+
+
+# Convert a schema file's verify expectation to the form get_expectation returns
+def schema_expectation(expect):
+    if expect == "previous":
+        return "previous"
+    if expect == "zeros":
+        return {"source": "/dev/zero"}
+    if isinstance(expect, dict) and len(expect) == 1:
+        if "pattern" in expect:
+            return {"source": None, "pattern": schema_hex(expect["pattern"], "pattern")}
+        if "seed" in expect:
+            return {"source": KEYSTREAM, "seed": schema_hex(expect["seed"], "seed")}
+        if "path" in expect and is_image_file(expect["path"]):
+            return {"source": expect["path"], "continuous_write": True}
+    raise ValueError(
+        'expect must be "previous", "zeros", {"pattern": hex}, {"seed": hex} '
+        'or {"path": non-empty file}'
+    )
+
+
+# Keys a schema file pass of this type can use with `engine`
+def schema_pass_keys(metadata, engine):
+    keys = {"device", "type"}
+    if metadata.get("verify"):
+        return keys | {"expect"}
+    if metadata.get("offload"):
+        return keys | ({"sample"} if metadata["offload"] == "discard" else set())
+    keys.add("engine")
+    if engine == "dd":
+        keys.add("flags")
+    else:
+        keys |= {"regions", "autotune", "tolerant"}
+    if engine == "async":
+        keys.add("queue_depth")
+    if metadata.get("requires_input_path"):
+        keys |= {"path", "continuous"}
+    if metadata.get("seeded"):
+        keys.add("seed")
+    if metadata.get("requires_pattern"):
+        keys.add("pattern")
+    return keys
+
+
+# Reject keys a pass would silently ignore
+def check_pass_keys(item, source_type, engine=None):
+    ignored = set(item) - schema_pass_keys(source_types_metadata[source_type], engine)
+    if ignored:
+        on_engine = f" on the {engine} engine" if engine else ""
+        raise ValueError(
+            f"{', '.join(sorted(ignored))} cannot be used with a {source_type} "
+            f"pass{on_engine}"
+        )
+
+
+# Build a schema entry from one pass of a schema file, raising ValueError
+# for anything the interactive prompts would not accept
+def schema_entry_from_pass(item):
+    if not isinstance(item, dict):
+        raise ValueError("each pass must be a table/object")
+    unknown = set(item) - SCHEMA_PASS_KEYS
+    if unknown:
+        raise ValueError(f"unknown key(s): {', '.join(sorted(unknown))}")
+    device = item.get("device")
+    if not isinstance(device, str) or not (
+        is_block_device(device) or is_image_file(device)
+    ):
+        raise ValueError(f"{device!r} is not a block device or non-empty image file")
+    source_type = item.get("type")
+    if source_type not in source_types_metadata:
+        raise ValueError(f"type must be one of: {', '.join(source_types_metadata)}")
+    metadata = source_types_metadata[source_type]
+
+    if metadata.get("verify"):
+        check_pass_keys(item, source_type)
+        expect = schema_expectation(item.get("expect", "previous"))
+        return make_verify_entry(device, expect)
+    if metadata.get("offload"):
+        check_pass_keys(item, source_type)
+        error = offload_error(device, source_type)
+        if error:
+            raise ValueError(error)
+        sample = 0
+        if metadata["offload"] == "discard":
+            sample = schema_number(item, "sample", 0, minimum=0)
+        return make_offload_entry(device, source_type, sample)
+
+    default_engine = "native" if metadata.get("native_only") else DEFAULT_ENGINE
+    engine = item.get("engine", default_engine)
+    if engine not in ("dd",) + IN_PROCESS_ENGINES:
+        raise ValueError("engine must be dd, native or async")
+    if metadata.get("native_only") and engine == "dd":
+        raise ValueError(f"type {source_type} needs the native or async engine")
+    check_pass_keys(item, source_type, engine)
+    flags = None
+    if engine == "dd":
+        flags = item.get("flags", default_dd_flags(device))
+        if not isinstance(flags, str):
+            raise ValueError("flags must be a string")
+    regions = schema_number(item, "regions", 1)
+    queue_depth = None
+    if engine == "async":
+        queue_depth = schema_number(item, "queue_depth", DEFAULT_QUEUE_DEPTH)
+
+    if_device = metadata.get("if_device")
+    continuous_write = metadata.get("continuous_write", False)
+    if metadata.get("requires_input_path"):
+        if_device = item.get("path")
+        if not (isinstance(if_device, str) and os.path.exists(if_device)):
+            raise ValueError(f"path {if_device!r} does not exist")
+        continuous_write = bool(item.get("continuous", False))
+    seed = None
+    if metadata.get("seeded"):
+        seed = schema_hex(item["seed"], "seed") if "seed" in item else new_seed()
+    pattern = None
+    if metadata.get("requires_pattern"):
+        pattern = schema_hex(item.get("pattern", "FF"), "pattern")
+        if_device = f"pattern:{pattern}"
+
+    return make_schema_entry(
+        device,
+        source_type,
+        if_device,
+        continuous_write,
+        engine,
+        flags,
+        seed,
+        regions,
+        queue_depth,
+        pattern,
+        bool(item.get("autotune", False)),
+        bool(item.get("tolerant", False)),
+    )
+
+
+# Names of the block devices holding mounted filesystems or active swap
+def busy_block_devices():
+    busy = set()
+    for table in ("/proc/self/mounts", "/proc/swaps"):
+        try:
+            with open(table) as f:
+                sources = [line.split()[0] for line in f if line.strip()]
+        except OSError:
+            continue
+        for source in sources:
+            if source.startswith("/dev/"):
+                busy.add(os.path.basename(os.path.realpath(source)))
+    return busy
+
+
+# List a sysfs directory, or [] if it does not exist
+def sysfs_entries(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+# Explain why a device must not be wiped: it, one of its partitions or a
+# device stacked on them (dm, md, ...) is in `busy`, or any of them is held
+# at all. Returns None for devices that are free.
+def device_in_use(device, busy, sysfs_root=SYSFS_ROOT):
+    if os.path.isfile(device):
+        return None
+    pending = [os.path.basename(os.path.realpath(device))]
+    seen = set()
+    held = []
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        if name in busy:
+            return f"{name} is mounted or used as swap"
+        block_dir = os.path.join(sysfs_root, "class", "block", name)
+        pending += [
+            entry
+            for entry in sysfs_entries(block_dir)
+            if os.path.isfile(os.path.join(block_dir, entry, "partition"))
+        ]
+        holders = sysfs_entries(os.path.join(block_dir, "holders"))
+        held += [f"{name} is held by {holder}" for holder in holders]
+        pending += holders
+    return held[0] if held else None
+
+
+# Name of the disk a partition belongs to, or None for whole devices
+def partition_parent(device, sysfs_root=SYSFS_ROOT):
+    if os.path.isfile(device):
+        return None
+    name = os.path.basename(os.path.realpath(device))
+    block_dir = os.path.realpath(os.path.join(sysfs_root, "class", "block", name))
+    if not os.path.isfile(os.path.join(block_dir, "partition")):
+        return None
+    return os.path.basename(os.path.dirname(block_dir))
+
+
+# Parse a fleet size bound: a byte count or a dd size such as 500G
+def fleet_size(selector, key):
+    value = selector.get(key)
+    if value is None or isinstance(value, int) and not isinstance(value, bool):
+        return value
+    size = parse_dd_size(value) if isinstance(value, str) else None
+    if size is None:
+        raise ValueError(f"{key} must be a byte count or a size such as 500G")
+    return size
+
+
+# Check a device of `size` bytes against the filters of a fleet selector
+def fleet_match(device, size, selector, sysfs_root=SYSFS_ROOT):
+    if "rotational" in selector:
+        rotational = read_queue_attribute(device, "rotational", sysfs_root)
+        if rotational is None or bool(rotational) != bool(selector["rotational"]):
+            return False
+    for name in ("model", "vendor"):
+        if name in selector:
+            value = read_device_attribute(device, name, sysfs_root)
+            if value is None or not fnmatch.fnmatch(value, selector[name]):
+                return False
+    min_size = fleet_size(selector, "min_size")
+    max_size = fleet_size(selector, "max_size")
+    if min_size is not None and size < min_size:
+        return False
+    return max_size is None or size <= max_size
+
+
+# Select the devices of a fleet: the explicit list plus glob matches, minus
+# exclusions, filtered by sysfs attributes. Devices that are mounted, used
+# as swap or held by another block device are always left out, as are
+# partitions whose disk matched too.
+def select_devices(selector, sysfs_root=SYSFS_ROOT):
+    if not isinstance(selector, dict):
+        raise ValueError("devices must be a table/object")
+    unknown = set(selector) - FLEET_SELECTOR_KEYS
+    if unknown:
+        raise ValueError(f"unknown device selector(s): {', '.join(sorted(unknown))}")
+    lists = {}
+    for key in ("glob", "list", "exclude"):
+        value = selector.get(key, [])
+        lists[key] = [value] if isinstance(value, str) else value
+        if not isinstance(lists[key], list) or not all(
+            isinstance(path, str) for path in lists[key]
+        ):
+            raise ValueError(f"{key} must be a path or a list of paths")
+    fleet_size(selector, "min_size")
+    fleet_size(selector, "max_size")
+
+    candidates = list(lists["list"])
+    for pattern in lists["glob"]:
+        candidates.extend(sorted(glob.glob(pattern)))
+    excluded = {os.path.realpath(path) for path in lists["exclude"]}
+    matched = []
+    for device in dict.fromkeys(candidates):
+        if os.path.realpath(device) in excluded:
+            continue
+        # Empty devices, such as unattached loop devices, are never selected
+        try:
+            size = get_device_size(device) if os.path.exists(device) else 0
+        except OSError:
+            size = 0
+        if not size or not (is_block_device(device) or is_image_file(device)):
+            if device in lists["list"]:
+                raise ValueError(f"{device!r} is not a non-empty device or image file")
+            continue
+        if fleet_match(device, size, selector, sysfs_root):
+            matched.append(device)
+
+    # A disk and its own partitions would be written by concurrent jobs
+    names = {os.path.basename(os.path.realpath(device)) for device in matched}
+    busy = busy_block_devices()
+    devices = []
+    for device in matched:
+        parent = partition_parent(device, sysfs_root)
+        if parent in names:
+            print(f"Skipping {device}: its disk {parent} is selected too.")
+            continue
+        reason = device_in_use(device, busy, sysfs_root)
+        if reason:
+            print(f"Skipping {device}: {reason}.")
+            continue
+        devices.append(device)
+    if not devices:
+        raise ValueError("no devices match the selector")
+    return devices
+
+
+# Load and validate a schema file; returns (entries, settings) or raises
+# ValueError listing every problem found. A fleet schema's template passes
+# are expanded into one job per selected device.
+def load_schema_file(path):
+    data = read_schema_file(path)
+    if not isinstance(data, dict):
+        raise ValueError("the schema must be a table/object")
+    errors = []
+    unknown = set(data) - set(SCHEMA_SETTINGS) - set(SCHEMA_RATE_LIMITS)
+    unknown -= {"passes", "devices", "template"}
+    if unknown:
+        errors.append(f"unknown key(s): {', '.join(sorted(unknown))}")
+    settings = {"repeat_count": 1, "max_retries": 0, "parallel_jobs": 0}
+    for key, setting in SCHEMA_SETTINGS.items():
+        try:
+            settings[setting] = schema_number(data, key, settings[setting], 0)
+        except ValueError as e:
+            errors.append(str(e))
+    for key, target in SCHEMA_RATE_LIMITS.items():
+        rate = parse_rate(data.get(key, 0))
+        if rate is None:
+            errors.append(f"{key} must be a bandwidth such as 200M")
+        settings[target] = rate
+    fleet = "devices" in data or "template" in data
+    passes = data.get("passes", [] if fleet else None)
+    if not isinstance(passes, list) or not (passes or fleet):
+        errors.append("passes must be a non-empty list")
+        passes = []
+    entries = []
+    for number, item in enumerate(passes, start=1):
+        try:
+            entries.append(schema_entry_from_pass(item))
+        except ValueError as e:
+            errors.append(f"pass {number}: {e}")
+    if fleet:
+        entries.extend(expand_template(data, errors))
+    for number, entry in enumerate(entries, start=1):
+        if entry["type"] == "verify":
+            error = expectation_error(entries[: number - 1], entry)
+            if error:
+                errors.append(f"pass {number} on {entry['device']}: {error}")
+    if errors:
+        raise ValueError("; ".join(errors))
+    return entries, settings
+
+
+# Expand a fleet schema's template into entries for every selected device,
+# device by device so each device's passes keep their order
+def expand_template(data, errors):
+    template = data.get("template")
+    if not isinstance(template, list) or not template:
+        errors.append("template must be a non-empty list")
+        return []
+    if any(isinstance(item, dict) and "device" in item for item in template):
+        errors.append("template passes take their device from devices")
+        return []
+    try:
+        devices = select_devices(data.get("devices"))
+    except ValueError as e:
+        errors.append(f"devices: {e}")
+        return []
+    entries = []
+    for device in devices:
+        failed = len(errors)
+        for number, item in enumerate(template, start=1):
+            try:
+                entries.append(schema_entry_from_pass(dict(item, device=device)))
+            except (TypeError, ValueError) as e:
+                errors.append(f"template pass {number} on {device}: {e}")
+        if len(errors) > failed:
+            # The same mistake would be reported for every other device
+            return []
+    print(f"Template applied to {len(devices)} device(s): {', '.join(devices)}")
+    return entries
+
+
+# Describe a schema entry as a pass of a schema file
+def schema_pass_from_entry(entry):
+    item = {"device": entry["device"], "type": entry["type"]}
+    if entry["type"] == "verify":
+        expect = entry.get("expect", "previous")
+        if expect != "previous":
+            kind, value = describe_expectation(expect).partition(":")[::2]
+            expect = {kind: value} if value else kind
+        item["expect"] = expect
+        return item
+    if entry["engine"] == "kernel":
+        if entry.get("sample"):
+            item["sample"] = entry["sample"]
+        return item
+    item["engine"] = entry["engine"]
+    if entry["engine"] == "dd":
+        item["flags"] = entry["flags"]
+    if source_types_metadata[entry["type"]].get("requires_input_path"):
+        item["path"] = entry["source"]
+        item["continuous"] = entry["continuous_write"]
+    for key in ("seed", "pattern", "regions", "queue_depth", "autotune", "tolerant"):
+        if entry.get(key):
+            item[key] = entry[key]
+    return item
+
+
+# Menu item: save the schema to a JSON file for --schema
+def save_schema():
+    if not schema_sources:
+        print("No sources to save.")
+        return
+    path = input("Save schema to (default: schema.json): ").strip() or "schema.json"
+    data = {
+        "repeat": schema_repeat_count,
+        "max_retries": max_retries_setting,
+        "parallel_jobs": max_parallel_jobs,
+    }
+    for key, target in SCHEMA_RATE_LIMITS.items():
+        if rate_limits[target]:
+            data[key] = format_size(rate_limits[target])
+    data["passes"] = [schema_pass_from_entry(entry) for entry in schema_sources]
+    try:
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+            f.write("\n")
+    except OSError as e:
+        print(f"Could not save the schema: {e}")
+        return
+    print(f"Schema saved to {path}; run it with --schema {path} --yes.")
+
+
+# argparse type for bandwidth options
+def rate_argument(value):
+    rate = parse_rate(value)
+    if rate is None:
+        raise argparse.ArgumentTypeError(f"invalid bandwidth: {value!r}")
+    return rate
+
+
+# Apply bandwidth limits given on the command line over those loaded
+def apply_rate_arguments(args):
+    for target, rate in (("global", args.rate_limit), ("jobs", args.job_rate_limit)):
+        if rate is not None:
+            set_rate_limit(target, rate)
+
+
+# Parse command-line options
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multi-pass disk preparation")
+    parser.add_argument(
+        "--bench-random",
+        action="store_true",
+        help="benchmark the fast random generator and exit",
+    )
+    parser.add_argument(
+        "--bench-engines",
+        metavar="TARGET",
+        help="benchmark the native and async engines on a loop device or file",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the schema run interrupted by Ctrl-C or a crash",
+    )
+    parser.add_argument(
+        "--journal",
+        default=journal_path,
+        help=f"checkpoint journal of the running schema (default: {journal_path})",
+    )
+    parser.add_argument(
+        "--schema",
+        metavar="FILE",
+        help="load a JSON or TOML schema file and run it instead of the menu",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=rate_argument,
+        metavar="RATE",
+        help="limit total bandwidth across all devices, e.g. 500M",
+    )
+    parser.add_argument(
+        "--job-rate-limit",
+        type=rate_argument,
+        metavar="RATE",
+        help="limit the bandwidth of each device, e.g. 100M",
+    )
+    parser.add_argument(
+        "--control",
+        default=rate_control_path,
+        help="file re-read during a run for '<global|jobs|device> <rate>' "
+        f"limit changes (default: {rate_control_path})",
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="run the --schema file without asking for confirmation",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.bench_random:
+        benchmark_random()
+        sys.exit(0)
+    if args.bench_engines:
+        benchmark_engines(args.bench_engines)
+        sys.exit(0)
     schema_repeat_count = 1
     max_retries_setting = 0  # Initialize with infinite retries
+    max_parallel_jobs = 0  # Run all devices in parallel
+    journal_path = args.journal
+    rate_control_path = args.control
     print("\033[1mMulti-Pass Disk Preparation Script\033[0m")
+    if args.resume:
+        try:
+            load_journal()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Cannot resume from {journal_path}: {e}")
+            sys.exit(1)
+        apply_rate_arguments(args)
+        print_schema()
+        sys.exit(0 if run_schema(resume=True) else 1)
+    if args.schema:
+        try:
+            entries, settings = load_schema_file(args.schema)
+        except (OSError, ValueError) as e:
+            print(f"Invalid schema {args.schema}: {e}")
+            sys.exit(2)
+        schema_sources[:] = entries
+        schema_repeat_count = settings["repeat_count"]
+        max_retries_setting = settings["max_retries"]
+        max_parallel_jobs = settings["parallel_jobs"]
+        set_rate_limit("global", settings["global"])
+        set_rate_limit("jobs", settings["jobs"])
+        apply_rate_arguments(args)
+        print_schema()
+        if not args.yes and input("Run this schema? [y/N]: ").strip().lower() != "y":
+            sys.exit(0)
+        sys.exit(0 if run_schema() else 1)
+    if os.path.exists(journal_path):
+        print(f"An interrupted run was found in {journal_path}; see --resume.")
+    apply_rate_arguments(args)
     main_menu()
@@ -0,0 +1,249 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import disk_puri
+
+
+# Build a fake sysfs tree holding one disk with the given queue attributes
+def make_sysfs(root, name, **queue):
+    queue_dir = os.path.join(root, "class", "block", name, "queue")
+    os.makedirs(queue_dir)
+    for attribute, value in queue.items():
+        with open(os.path.join(queue_dir, attribute), "w") as f:
+            f.write(f"{value}\n")
+
+
+class TopologyTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.root = self.directory.name
+
+    # Probe a fake disk and pick its geometry
+    def geometry(self, **queue):
+        make_sysfs(self.root, "sdx", **queue)
+        topology = disk_puri.probe_topology("/dev/sdx", self.root)
+        return disk_puri.choose_geometry(topology)
+
+    def test_512n_capped_by_max_sectors(self):
+        self.assertEqual(
+            self.geometry(
+                logical_block_size=512,
+                physical_block_size=512,
+                optimal_io_size=0,
+                max_sectors_kb=1280,
+            ),
+            (3 * 1280 * 1024, 512),
+        )
+
+    def test_512e_aligns_to_logical_blocks(self):
+        block_size, alignment = self.geometry(
+            logical_block_size=512, physical_block_size=4096
+        )
+        self.assertEqual((block_size, alignment), (disk_puri.NATIVE_BLOCK_SIZE, 512))
+
+    def test_4kn(self):
+        self.assertEqual(
+            self.geometry(logical_block_size=4096, physical_block_size=4096),
+            (disk_puri.NATIVE_BLOCK_SIZE, 4096),
+        )
+
+    def test_optimal_io_size(self):
+        # Whole 1.5 MiB optimal units fit twice into the 4 MiB default
+        self.assertEqual(
+            self.geometry(
+                logical_block_size=512,
+                physical_block_size=4096,
+                optimal_io_size=1536 * 1024,
+            ),
+            (3 * 1024 * 1024, 512),
+        )
+
+    def test_max_sectors_not_a_multiple_of_the_unit_is_ignored(self):
+        self.assertEqual(
+            self.geometry(
+                logical_block_size=4096,
+                physical_block_size=4096,
+                optimal_io_size=1536 * 1024,
+                max_sectors_kb=1024,
+            ),
+            (3 * 1024 * 1024, 4096),
+        )
+
+    def test_unreadable_attributes(self):
+        make_sysfs(self.root, "sdx", logical_block_size="garbage")
+        topology = disk_puri.probe_topology("/dev/sdx", self.root)
+        self.assertIsNone(topology["logical_block_size"])
+        self.assertEqual(
+            disk_puri.choose_geometry(topology),
+            (disk_puri.NATIVE_BLOCK_SIZE, disk_puri.VERIFY_SECTOR_SIZE),
+        )
+
+    def test_unknown_device(self):
+        self.assertIsNone(disk_puri.probe_topology("/dev/sdx", self.root))
+        self.assertEqual(
+            disk_puri.choose_geometry(None),
+            (disk_puri.NATIVE_BLOCK_SIZE, disk_puri.DIRECT_IO_ALIGNMENT),
+        )
+
+
+class ExtentTest(unittest.TestCase):
+    # Build an interval set from (start, end) pairs
+    def extents(self, *pairs):
+        extents = disk_puri.new_extent_set()
+        for start, end in pairs:
+            disk_puri.extent_add(extents, start, end)
+        return extents
+
+    def test_add_merges_overlapping_and_adjacent(self):
+        extents = self.extents((10, 20), (30, 40), (20, 25), (35, 50), (0, 5))
+        self.assertEqual(disk_puri.extent_list(extents), [(0, 5), (10, 25), (30, 50)])
+        disk_puri.extent_add(extents, 4, 31)
+        self.assertEqual(disk_puri.extent_list(extents), [(0, 50)])
+
+    def test_add_ignores_empty_ranges(self):
+        self.assertEqual(disk_puri.extent_list(self.extents((5, 5), (7, 3))), [])
+
+    def test_remove_splits_and_trims(self):
+        extents = self.extents((0, 10), (20, 30))
+        disk_puri.extent_remove(extents, 3, 5)
+        disk_puri.extent_remove(extents, 8, 25)
+        self.assertEqual(disk_puri.extent_list(extents), [(0, 3), (5, 8), (25, 30)])
+
+    def test_remove_ignores_empty_ranges(self):
+        extents = self.extents((10, 15))
+        disk_puri.extent_remove(extents, 12, 12)
+        disk_puri.extent_remove(extents, 14, 11)
+        self.assertEqual(disk_puri.extent_list(extents), [(10, 15)])
+
+    def test_reach(self):
+        extents = self.extents((10, 20))
+        self.assertEqual(disk_puri.extent_reach(extents, 12), 20)
+        self.assertEqual(disk_puri.extent_reach(extents, 20), 20)
+        self.assertEqual(disk_puri.extent_reach(extents, 5), 5)
+
+
+class DdCountTest(unittest.TestCase):
+    def test_whole_blocks(self):
+        flags = "bs=4M iflag=fullblock"
+        self.assertEqual(disk_puri.dd_count_operands(flags, 8 * 2**20), "count=2")
+
+    def test_partial_block(self):
+        self.assertEqual(
+            disk_puri.dd_count_operands("bs=4M iflag=fullblock", 5000),
+            "count=5000 iflag=count_bytes",
+        )
+
+    def test_without_fullblock(self):
+        # Short reads would make dd count partial blocks
+        self.assertEqual(
+            disk_puri.dd_count_operands("bs=1M", 2**20),
+            f"count={2**20} iflag=count_bytes",
+        )
+
+    def test_default_block_size(self):
+        self.assertEqual(
+            disk_puri.dd_count_operands("iflag=fullblock", 1024), "count=2"
+        )
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(disk_puri.time, "monotonic", return_value=100.0)
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unlimited(self):
+        bucket = disk_puri.new_bucket(0)
+        self.assertEqual(disk_puri.take_tokens(bucket, 10**9), 0)
+
+    def test_burst_then_debt(self):
+        bucket = disk_puri.new_bucket(1000)
+        self.assertEqual(disk_puri.take_tokens(bucket, 250), 0)
+        self.assertAlmostEqual(disk_puri.take_tokens(bucket, 500), 0.5)
+        self.clock.return_value = 100.5
+        self.assertEqual(disk_puri.take_tokens(bucket, 0), 0)
+
+    def test_idle_time_saves_at_most_the_burst(self):
+        bucket = disk_puri.new_bucket(1000)
+        self.clock.return_value = 200.0
+        self.assertAlmostEqual(disk_puri.take_tokens(bucket, 1250), 1.0)
+
+
+class SchemaFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.image = os.path.join(self.directory.name, "disk.img")
+        with open(self.image, "wb") as f:
+            f.truncate(1024 * 1024)
+
+    # Load a schema written as JSON
+    def load(self, data):
+        path = os.path.join(self.directory.name, "schema.json")
+        with open(path, "w") as f:
+            json.dump(data, f)
+        return disk_puri.load_schema_file(path)
+
+    # Check that loading fails and the error mentions every fragment
+    def assert_invalid(self, data, *fragments):
+        with self.assertRaises(ValueError) as raised:
+            self.load(data)
+        for fragment in fragments:
+            self.assertIn(fragment, str(raised.exception))
+
+    def test_valid(self):
+        entries, settings = self.load(
+            {
+                "repeat": 2,
+                "rate_limit": "50M",
+                "passes": [
+                    {"device": self.image, "type": "pattern", "pattern": "A5"},
+                    {"device": self.image, "type": "verify"},
+                ],
+            }
+        )
+        self.assertEqual([entry["type"] for entry in entries], ["pattern", "verify"])
+        self.assertEqual(entries[0]["pattern"], "a5")
+        self.assertEqual(settings["repeat_count"], 2)
+        self.assertEqual(settings["global"], 50 * 2**20)
+
+    def test_every_problem_is_reported(self):
+        self.assert_invalid(
+            {"bogus": 1, "repeat": -1, "rate_limit": "fast", "passes": []},
+            "unknown key(s): bogus",
+            "repeat",
+            "rate_limit",
+            "passes must be a non-empty list",
+        )
+
+    def test_unknown_type(self):
+        self.assert_invalid(
+            {"passes": [{"device": self.image, "type": "nope"}]},
+            "pass 1: type must be one of",
+        )
+
+    def test_inapplicable_key(self):
+        self.assert_invalid(
+            {"passes": [{"device": self.image, "type": "zeros", "tolerant": True}]},
+            "tolerant cannot be used",
+        )
+
+    def test_verify_needs_an_earlier_pass(self):
+        self.assert_invalid(
+            {"passes": [{"device": self.image, "type": "verify"}]},
+            "No earlier pass on this device to verify",
+        )
+
+    def test_missing_device(self):
+        missing = os.path.join(self.directory.name, "missing.img")
+        self.assert_invalid(
+            {"passes": [{"device": missing, "type": "zeros"}]}, "pass 1:"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()